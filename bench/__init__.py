@@ -0,0 +1,7 @@
+"""
+Benchmarks of the SunMoon plugin, run outside Domoticz with standalone.
+
+benchmark     timing and call counts of onStart and onHeartbeat
+simulate      the plugin over whole days in virtual time
+solaraccuracy accuracy of the numpy solar backend against ephem
+"""
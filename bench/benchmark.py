@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""
+Benchmark of the SunMoon plugin hot path.
+
+Runs the plugin with the fake Domoticz framework and a virtual clock for a
+number of latitudes (including polar ones) and dates. For every scenario it
+times onStart and onHeartbeat, and counts the ephem calls and device writes
+per heartbeat. The results are written as JSON.
+
+    python -m bench.benchmark [--hours 24] [--output bench.json]
+
+Devices can be deleted after onStart with --remove, eg. --remove 3 4 8 9 for
+the nautical and astronomical twilights.
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import ephem
+
+import standalone
+
+LATITUDES = [-77.85, -33.92, 0.0, 35.68, 52.37, 66.56, 69.65, 78.22]
+LONGITUDE = 4.89
+DATES = ["2026-03-20", "2026-06-21", "2026-09-23", "2026-12-21"]
+HEARTBEAT = 10  # seconds
+
+# ephem functions and methods of which the calls are counted
+SEARCHES = [
+    "next_new_moon",
+    "next_first_quarter_moon",
+    "next_full_moon",
+    "next_last_quarter_moon",
+    "previous_new_moon",
+    "previous_first_quarter_moon",
+    "previous_full_moon",
+    "previous_last_quarter_moon",
+    "next_equinox",
+    "next_solstice",
+    "previous_equinox",
+    "previous_solstice",
+]
+OBSERVER_SEARCHES = [
+    "next_rising",
+    "next_setting",
+    "next_transit",
+    "next_antitransit",
+    "previous_rising",
+    "previous_setting",
+    "previous_transit",
+    "previous_antitransit",
+]
+
+
+class Counter(collections.Counter):
+    def wrap(self, name, function):
+        def counted(*args, **kwargs):
+            self[name] += 1
+            return function(*args, **kwargs)
+
+        return counted
+
+
+def counting_ephem(counter):
+    """
+    A stand-in for the ephem module which counts searches, position
+    computations of the Sun and the Moon, and Observer searches.
+    """
+    module = type(ephem)("ephem")
+    module.__dict__.update(ephem.__dict__)
+    for name in SEARCHES:
+        if hasattr(ephem, name):
+            setattr(module, name, counter.wrap(name, getattr(ephem, name)))
+
+    def body(cls):
+        class Counted(cls):
+            def compute(self, *args, **kwargs):
+                counter["{}.compute".format(cls.__name__)] += 1
+                return cls.compute(self, *args, **kwargs)
+
+        Counted.__name__ = cls.__name__
+        return Counted
+
+    module.Sun = body(ephem.Sun)
+    module.Moon = body(ephem.Moon)
+
+    class Observer(ephem.Observer):
+        pass
+
+    for name in OBSERVER_SEARCHES:
+        setattr(
+            Observer,
+            name,
+            counter.wrap("Observer." + name, getattr(ephem.Observer, name)),
+        )
+    module.Observer = Observer
+    return module
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(latitude, date, hours, parameters, home, remove=()):
+    clock = standalone.Clock(datetime.datetime.strptime(date, "%Y-%m-%d"))
+    plugin = standalone.Plugin(
+        "{};{}".format(latitude, LONGITUDE),
+        parameters=parameters,
+        clock=clock,
+        home=home + os.sep,
+    )
+    counter = Counter()
+    plugin.module.ephem = counting_ephem(counter)
+    #
+    started = time.perf_counter()
+    plugin.onStart()
+    start = time.perf_counter() - started
+    start_calls = sum(counter.values())
+    counter.clear()
+    writes = plugin.Writes
+    with plugin:
+        for Unit in remove:
+            plugin.Devices[Unit].Delete()
+    #
+    durations = []
+    calls = []
+    writes_per_tick = []
+    for _ in range(int(hours * 3600 / HEARTBEAT)):
+        before = sum(counter.values())
+        written = plugin.Writes
+        started = time.perf_counter()
+        plugin.onHeartbeat()
+        durations.append(time.perf_counter() - started)
+        calls.append(sum(counter.values()) - before)
+        writes_per_tick.append(plugin.Writes - written)
+        clock.advance(HEARTBEAT)
+    plugin.onStop()
+    return {
+        "latitude": latitude,
+        "longitude": LONGITUDE,
+        "date": date,
+        "hours": hours,
+        "removed": list(remove),
+        "onStart": {
+            "seconds": start,
+            "ephem_calls": start_calls,
+            "writes": writes,
+        },
+        "onHeartbeat": {
+            "ticks": len(durations),
+            "seconds_total": sum(durations),
+            "seconds_mean": sum(durations) / len(durations),
+            "seconds_p95": percentile(durations, 95),
+            "seconds_max": max(durations),
+            "idle_ticks": calls.count(0),
+            "ephem_calls": sum(calls),
+            "ephem_calls_max": max(calls),
+            "ephem_calls_by_name": dict(counter),
+            "writes": sum(writes_per_tick),
+            "writes_max": max(writes_per_tick),
+        },
+        "errors": plugin.Messages["Error"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hours", type=float, default=24, help="hours per scenario")
+    parser.add_argument("--latitudes", type=float, nargs="+", default=LATITUDES)
+    parser.add_argument("--dates", nargs="+", default=DATES)
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="plugin parameter, eg. Mode2=0.1",
+    )
+    parser.add_argument(
+        "--remove",
+        type=int,
+        nargs="+",
+        default=[],
+        metavar="UNIT",
+        help="units of the devices to delete after onStart",
+    )
+    parser.add_argument("--output", default="-", help="JSON report, - for stdout")
+    args = parser.parse_args(argv)
+    parameters = dict(p.split("=", 1) for p in args.param)
+    standalone.verbose = set()
+    #
+    scenarios = []
+    for latitude in args.latitudes:
+        for date in args.dates:
+            # A plugin folder per scenario, for its state and statistics
+            with tempfile.TemporaryDirectory(prefix="sunmoon_bench_") as home:
+                result = run(latitude, date, args.hours, parameters, home, args.remove)
+            scenarios.append(result)
+            print(
+                "{:>7} {} mean {:8.1f} us, ephem calls {:6}, writes {:6}".format(
+                    latitude,
+                    date,
+                    result["onHeartbeat"]["seconds_mean"] * 1e6,
+                    result["onHeartbeat"]["ephem_calls"],
+                    result["onHeartbeat"]["writes"],
+                ),
+                file=sys.stderr,
+            )
+    report = {
+        "python": platform.python_version(),
+        "ephem": ephem.__version__,
+        "parameters": parameters,
+        "heartbeat": HEARTBEAT,
+        "scenarios": scenarios,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
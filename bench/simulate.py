@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""
+Simulation of the SunMoon plugin over a number of days in virtual time.
+
+Runs onStart and then a heartbeat every heartbeat interval of virtual time,
+as fast as possible, with the fake Domoticz framework and a virtual clock.
+Per simulated local day it reports the ephem calls, device writes, errors
+and CPU time. It marks the days with a DST transition and the polar days
+and nights, on which the sun does not rise or set. The results are written
+as JSON.
+
+    python -m bench.simulate --location "69.65;18.96" --tz Europe/Oslo --first 2026-01-01 --days 365
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import standalone
+from bench.benchmark import Counter, counting_ephem
+
+
+def utc_offset(utc_now):
+    return (
+        datetime.datetime.fromtimestamp(
+            utc_now.replace(tzinfo=datetime.timezone.utc).timestamp()
+        )
+        - utc_now
+    )
+
+
+def simulate(location, first, days, heartbeat, parameters, remove=()):
+    """
+    Run the plugin from 00:00 local time of first for a number of local
+    days. Returns the statistics per day.
+    """
+    clock = standalone.Clock()
+    # Its own plugin folder, the plugin writes its state there on onStop
+    home = tempfile.mkdtemp(prefix="sunmoon_simulate_")
+    plugin = standalone.Plugin(
+        location, parameters=parameters, clock=clock, home=home + os.sep
+    )
+    # Midnight as the plugin itself computes it, from noon local time
+    LocalMidnight = plugin.module.LocalMidnight
+    noon = datetime.datetime.combine(first, datetime.time(12)).astimezone(
+        datetime.timezone.utc
+    )
+    clock.utc_now = start = LocalMidnight(noon.replace(tzinfo=None))
+    counter = Counter()
+    plugin.module.ephem = counting_ephem(counter)
+    plugin.onStart()
+    with plugin:
+        for Unit in remove:
+            plugin.Devices[Unit].Delete()
+    unit = plugin.module.unit
+    result = []
+    for day in range(days):
+        date = first + datetime.timedelta(days=day)
+        end = LocalMidnight(start, day + 1)
+        counter.clear()
+        writes = plugin.Writes
+        errors = plugin.Messages["Error"]
+        ticks = 0
+        started = time.process_time()
+        offset = utc_offset(clock.utc_now)
+        while clock.utc_now < end:
+            plugin.onHeartbeat()
+            clock.advance(heartbeat)
+            ticks += 1
+        cpu = time.process_time() - started
+        sunrise = plugin.Devices.get(unit.SUN_RISE)
+        result.append(
+            {
+                "date": date.isoformat(),
+                "heartbeats": ticks,
+                "cpu_seconds": cpu,
+                "ephem_calls": sum(counter.values()),
+                "ephem_calls_by_name": dict(counter),
+                "writes": plugin.Writes - writes,
+                "errors": plugin.Messages["Error"] - errors,
+                "dst_transition": utc_offset(clock.utc_now) != offset,
+                "sunrise": None if sunrise is None else sunrise.sValue,
+                # Sunrise shows a state instead of a time
+                "polar": sunrise is not None and not sunrise.sValue[:1].isdigit(),
+            }
+        )
+    plugin.onStop()
+    shutil.rmtree(home, ignore_errors=True)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--location", default="52.37;4.89", help="latitude;longitude")
+    parser.add_argument(
+        "--first",
+        default=datetime.date.today().isoformat(),
+        help="first day, YYYY-MM-DD",
+    )
+    parser.add_argument("--days", type=int, default=365, help="number of days")
+    parser.add_argument(
+        "--heartbeat", type=float, default=10, help="heartbeat interval (s)"
+    )
+    parser.add_argument("--tz", help="time zone, eg. Europe/Amsterdam")
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="plugin parameter, eg. Mode2=0.1",
+    )
+    parser.add_argument(
+        "--remove",
+        type=int,
+        nargs="+",
+        default=[],
+        metavar="UNIT",
+        help="units of the devices to delete after onStart",
+    )
+    parser.add_argument("--output", default="-", help="JSON report, - for stdout")
+    args = parser.parse_args(argv)
+    if args.tz:
+        os.environ["TZ"] = args.tz
+        time.tzset()
+    parameters = dict(p.split("=", 1) for p in args.param)
+    first = datetime.datetime.strptime(args.first, "%Y-%m-%d").date()
+    standalone.verbose = {"Error"}
+    #
+    started = time.perf_counter()
+    days = simulate(
+        args.location, first, args.days, args.heartbeat, parameters, args.remove
+    )
+    seconds = time.perf_counter() - started
+    totals = {
+        name: sum(day[name] for day in days)
+        for name in ("heartbeats", "cpu_seconds", "ephem_calls", "writes", "errors")
+    }
+    print(
+        "{} days in {:.1f} s: {:.3f} s CPU, {:.0f} ephem calls and {:.0f} writes per day, {} errors".format(
+            len(days),
+            seconds,
+            totals["cpu_seconds"] / len(days),
+            totals["ephem_calls"] / len(days),
+            totals["writes"] / len(days),
+            totals["errors"],
+        ),
+        file=sys.stderr,
+    )
+    for day in days:
+        if day["dst_transition"]:
+            print("{} DST transition".format(day["date"]), file=sys.stderr)
+    print(
+        "{} polar days and nights".format(sum(day["polar"] for day in days)),
+        file=sys.stderr,
+    )
+    report = {
+        "location": args.location,
+        "tz": args.tz,
+        "heartbeat": args.heartbeat,
+        "parameters": parameters,
+        "seconds": seconds,
+        "totals": totals,
+        "days": days,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""
+Accuracy of the numpy solar backend against the ephem reference.
+
+Compares altitude, azimuth, distance and horizon crossings of both backends
+over a multi-year grid of instants and latitudes, and reports the maximum
+deviations and the time per sample of each backend as JSON.
+
+    python -m bench.solaraccuracy [--years 2020 2030] [--output solar.json]
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+
+import numpy as np
+
+import solar
+
+LATITUDES = [-77.85, -33.92, 0.0, 35.68, 52.37, 66.56, 69.65, 78.22]
+LONGITUDE = 4.89
+# Twilights, their horizons and whether to use the centre of the Sun or not
+TWILIGHTS = [(0.0, False), (-6.0, True), (-12.0, True), (-18.0, True)]
+
+
+def grid(first, last, step):
+    start = datetime.datetime(first, 1, 1, tzinfo=datetime.timezone.utc)
+    end = datetime.datetime(last + 1, 1, 1, tzinfo=datetime.timezone.utc)
+    return np.arange(start.timestamp(), end.timestamp(), step, dtype=float)
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def compare_positions(reference, candidate, latitude, timestamps):
+    ref, ref_seconds = timed(reference.position, latitude, LONGITUDE, timestamps)
+    new, new_seconds = timed(candidate.position, latitude, LONGITUDE, timestamps)
+    alt = np.asarray(ref[0])
+    d_alt = np.abs(np.asarray(new[0]) - alt)
+    d_az = np.abs((np.asarray(new[1]) - np.asarray(ref[1]) + 180) % 360 - 180)
+    d_dist = np.abs(np.asarray(new[2]) - np.asarray(ref[2]))
+    # Azimuth is ill-defined close to the zenith
+    below_zenith = alt < 89
+    return {
+        "samples": len(timestamps),
+        "altitude_max": float(d_alt.max()),
+        "azimuth_max": float(d_az[below_zenith].max()),
+        "distance_km_max": float(d_dist.max()),
+        "seconds_per_sample": {
+            reference.name: ref_seconds / len(timestamps),
+            candidate.name: new_seconds / len(timestamps),
+        },
+    }
+
+
+def compare_crossings(reference, candidate, latitude, starts):
+    result = {}
+    for horizon, use_center in TWILIGHTS:
+        ref = reference.crossings(latitude, LONGITUDE, starts, horizon, use_center)
+        new = candidate.crossings(latitude, LONGITUDE, starts, horizon, use_center)
+        deviations = []
+        mismatches = 0
+        for ref_times, new_times in zip(ref, new):
+            for r, n in zip(ref_times, new_times):
+                if r is None or np.isnan(n):
+                    # One backend found a crossing, the other did not
+                    mismatches += (r is None) != bool(np.isnan(n))
+                else:
+                    deviations.append(abs(r - n))
+        result[str(horizon)] = {
+            "crossings": len(deviations),
+            "seconds_max": max(deviations) if deviations else None,
+            "mismatches": mismatches,
+        }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--years", type=int, nargs=2, default=[2020, 2030])
+    parser.add_argument("--latitudes", type=float, nargs="+", default=LATITUDES)
+    parser.add_argument(
+        "--step", type=float, default=6037, help="seconds between position samples"
+    )
+    parser.add_argument(
+        "--days", type=int, default=7, help="days between crossing searches"
+    )
+    parser.add_argument("--output", default="-", help="JSON report, - for stdout")
+    args = parser.parse_args(argv)
+    reference = solar.backend("ephem")
+    candidate = solar.backend("numpy")
+    #
+    positions = grid(args.years[0], args.years[1], args.step)
+    starts = grid(args.years[0], args.years[1], args.days * 86400)
+    latitudes = []
+    for latitude in args.latitudes:
+        result = {
+            "latitude": latitude,
+            "position": compare_positions(reference, candidate, latitude, positions),
+            "crossings": compare_crossings(reference, candidate, latitude, starts),
+        }
+        latitudes.append(result)
+        print(
+            "{:>7}: altitude {:.4f}°, azimuth {:.4f}°, distance {:.0f} km, sunrise {:.1f} s".format(
+                latitude,
+                result["position"]["altitude_max"],
+                result["position"]["azimuth_max"],
+                result["position"]["distance_km_max"],
+                result["crossings"]["0.0"]["seconds_max"] or 0,
+            ),
+            file=sys.stderr,
+        )
+    report = {
+        "years": args.years,
+        "longitude": LONGITUDE,
+        "latitudes": latitudes,
+        "altitude_max": max(r["position"]["altitude_max"] for r in latitudes),
+        "azimuth_max": max(r["position"]["azimuth_max"] for r in latitudes),
+        "distance_km_max": max(r["position"]["distance_km_max"] for r in latitudes),
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""
+Precomputed yearly table of the daily sun and moon events for one location.
+
+The table is a binary file with a header (year, latitude, longitude) and one
+fixed-width record per day of the year. All times are int32 seconds since
+the Unix epoch (UTC), truncated to the second, and read back as the middle
+of that second. The devices show times rounded to the minute, which then
+gives the same minute as the computed time. The events of a day are
+searched from 00:00 UTC of that day, the same way the plugin searches them:
+
+    sun rising and setting for the horizons 0, -6, -12 and -18 degrees
+    sun transit
+    moon rising and setting
+    previous and next new moon, first quarter, full moon and last quarter
+
+The plugin memory-maps the table of the current year from its folder and
+falls back to ephem when there is no table, or it is for another location.
+Generate a table with:
+
+    python3 eventtable.py --lat 52.37 --lon 4.89 --year 2027
+"""
+import argparse
+import datetime
+import math
+import mmap
+import os
+import struct
+
+# The plugin uses the horizons and quarters of the table, also without ephem
+try:
+    import ephem
+except ImportError:
+    ephem = None
+
+MAGIC = b"SMEV"
+VERSION = 2
+HEADER = struct.Struct("<4sHhddHH")
+RECORD = struct.Struct("<19i")
+# No time available, eg. the sun does not rise at all
+NONE = -(2**31)
+# Unix epoch as ephem date, ephem.Date(datetime.datetime(1970, 1, 1))
+EPOCH = 25567.5
+
+# Twilights, their horizons and whether to use the centre of the Sun or not,
+# and the lunar quarters. The plugin uses these too, in the same order.
+TWILIGHTS = [("0", False), ("-6", True), ("-12", True), ("-18", True)]
+QUARTERS = ["new_moon", "first_quarter_moon", "full_moon", "last_quarter_moon"]
+
+# Fields of a record
+SUN_RISE = 0  # 0..3, per twilight
+SUN_SET = 4  # 4..7, per twilight
+SUN_TRANSIT = 8
+MOON_RISE = 9
+MOON_SET = 10
+QUARTER_PREVIOUS = 11  # 11, 13, 15, 17, per quarter
+QUARTER_NEXT = 12  # 12, 14, 16, 18, per quarter
+
+
+def filename(year):
+    return "sunmoon_events_{}.bin".format(year)
+
+
+def to_seconds(date):
+    if date is None:
+        return NONE
+    return math.floor((date - EPOCH) * 86400)
+
+
+def to_date(seconds):
+    if seconds == NONE:
+        return None
+    return ephem.Date(EPOCH + (seconds + 0.5) / 86400)
+
+
+def day_record(observer, date):
+    """
+    Events of one day, searched from 00:00 UTC of date, as a record.
+    """
+    sun = ephem.Sun()
+    moon = ephem.Moon()
+    rising = []
+    setting = []
+    for horizon, use_center in TWILIGHTS:
+        observer.date = date
+        observer.horizon = horizon
+        sun.compute(observer)
+        try:
+            rising.append(observer.next_rising(sun, use_center=use_center))
+        except (ephem.AlwaysUpError, ephem.NeverUpError):
+            rising.append(None)
+        try:
+            setting.append(observer.next_setting(sun, use_center=use_center))
+        except (ephem.AlwaysUpError, ephem.NeverUpError):
+            setting.append(None)
+    observer.horizon = "0"
+    observer.date = date
+    values = rising + setting + [observer.next_transit(sun)]
+    for search in (observer.next_rising, observer.next_setting):
+        observer.date = date
+        try:
+            values.append(search(moon))
+        except (ephem.AlwaysUpError, ephem.NeverUpError):
+            values.append(None)
+    for name in QUARTERS:
+        values.append(getattr(ephem, "previous_" + name)(date))
+        values.append(getattr(ephem, "next_" + name)(date))
+    return [to_seconds(value) for value in values]
+
+
+def generate(lat, lon, year, path):
+    """
+    Compute the events of every day of year for the location and write
+    them as a table to path.
+    """
+    observer = ephem.Observer()
+    observer.lat = str(lat)
+    observer.lon = str(lon)
+    first = datetime.date(year, 1, 1)
+    days = (datetime.date(year + 1, 1, 1) - first).days
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, year, lat, lon, days, RECORD.size))
+        for day in range(days):
+            date = first + datetime.timedelta(days=day)
+            f.write(RECORD.pack(*day_record(observer, date)))
+
+
+class EventTable:
+    """
+    Memory-mapped event table. record(date) returns the events of a day as a
+    list of ephem dates (None for no time available), or None when the date
+    is not in the table.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.__map) < HEADER.size:
+            self.close()
+            raise ValueError("{}: truncated".format(path))
+        magic, version, self.year, self.lat, self.lon, self.days, size = (
+            HEADER.unpack_from(self.__map, 0)
+        )
+        if magic != MAGIC or size != RECORD.size:
+            self.close()
+            raise ValueError("{}: not an event table".format(path))
+        if version != VERSION:
+            self.close()
+            raise ValueError(
+                "{}: old version of the event table, generate it again".format(path)
+            )
+        if len(self.__map) < HEADER.size + self.days * RECORD.size:
+            self.close()
+            raise ValueError("{}: truncated".format(path))
+
+    def matches(self, lat, lon):
+        return abs(self.lat - float(lat)) < 1e-6 and abs(self.lon - float(lon)) < 1e-6
+
+    def record(self, date):
+        if date.year != self.year:
+            return None
+        day = date.timetuple().tm_yday - 1
+        if day >= self.days:
+            return None
+        values = RECORD.unpack_from(self.__map, HEADER.size + day * RECORD.size)
+        return [to_date(value) for value in values]
+
+    def close(self):
+        self.__map.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate a yearly table of sun and moon events"
+    )
+    parser.add_argument("--lat", type=float, required=True, help="latitude")
+    parser.add_argument("--lon", type=float, required=True, help="longitude")
+    parser.add_argument(
+        "--year", type=int, default=datetime.date.today().year, help="year"
+    )
+    parser.add_argument(
+        "--output", help="table file, default sunmoon_events_<year>.bin"
+    )
+    args = parser.parse_args(argv)
+    path = args.output or filename(args.year)
+    generate(args.lat, args.lon, args.year, path)
+    print("{}: {} bytes".format(path, os.path.getsize(path)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""
+Export of the daily sun and moon events over a range of dates.
+
+The events are computed by the plugin itself, run with the stand-in for
+the Domoticz framework of standalone.py and a virtual clock at 00:00 local
+time of every day. So every row holds exactly the values the devices show
+at the start of that day: sunrise, sunset and twilights, sun transit, day
+length, moonrise, moonset, moon phase, the next lunar quarters and the
+seasonal events. The rows are streamed as CSV or JSON Lines, and long
+ranges are split in chunks over a pool of processes:
+
+    python3 export.py --lat 52.37 --lon 4.89 --first 2027-01-01 --last 2027-12-31 --output 2027.csv
+
+Times are in the local time zone, as in Domoticz. Event tables in the
+plugin folder are used in the same way as by the plugin.
+"""
+import argparse
+import csv
+import datetime
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+import standalone
+
+# Days per chunk of work for a process
+CHUNK = 32
+FORMATS = ["csv", "jsonl"]
+
+
+def days(lat, lon, first, last, home=None):
+    """
+    Rows of the events per day from first up to and including last, each a
+    dict with the date and the value of every event device by its name.
+    """
+    folder = tempfile.mkdtemp(prefix="sunmoon_export_")
+    try:
+        # Only the event tables of the plugin folder, not its saved state
+        for path in glob.glob(
+            os.path.join(
+                home or os.path.dirname(standalone.PLUGIN), "sunmoon_events_*.bin"
+            )
+        ):
+            shutil.copy(path, folder)
+        clock = standalone.Clock()
+        plugin = standalone.Plugin(
+            "{};{}".format(lat, lon), clock=clock, home=folder + os.sep
+        )
+        # Midnight as the plugin itself computes it, from noon local time
+        LocalMidnight = plugin.module.LocalMidnight
+        noon = datetime.datetime.combine(first, datetime.time(12)).astimezone(
+            datetime.timezone.utc
+        )
+        start = LocalMidnight(noon.replace(tzinfo=None))
+        clock.utc_now = start
+        plugin.onStart()
+        unit = plugin.module.unit
+        # Positions, switches and irradiance change all the time, not events
+        with plugin:
+            for Unit in (
+                unit.SUN_AZ,
+                unit.SUN_ALT,
+                unit.SUN_DIST,
+                unit.MOON_AZ,
+                unit.MOON_ALT,
+                unit.MOON_DIST,
+                unit.MOON_ILLUMINATION,
+                unit.DAYLIGHT,
+                unit.CIVIL_TWILIGHT,
+                unit.NAUTICAL_TWILIGHT,
+                unit.ASTRONOMICAL_TWILIGHT,
+                unit.NIGHT,
+                unit.MOON_UP,
+                unit.IRRADIANCE,
+            ):
+                plugin.Devices[Unit].Delete()
+        date = first
+        while date <= last:
+            clock.utc_now = LocalMidnight(start, (date - first).days)
+            plugin.onHeartbeat()
+            row = {"date": date.isoformat()}
+            for Unit in sorted(plugin.Devices):
+                row[plugin.Devices[Unit].Name] = plugin.Devices[Unit].sValue
+            yield row
+            date += datetime.timedelta(days=1)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def _chunk(args):
+    standalone.verbose = {"Error"}
+    return list(days(*args))
+
+
+def rows(lat, lon, first, last, home=None, processes=None):
+    """
+    Rows of the events per day, in order of date. With more than one
+    process the range is split in chunks, computed by a pool of processes.
+    """
+    if processes == 1:
+        yield from days(lat, lon, first, last, home)
+        return
+    chunks = []
+    start = first
+    while start <= last:
+        end = min(start + datetime.timedelta(days=CHUNK - 1), last)
+        chunks.append((lat, lon, start, end, home))
+        start = end + datetime.timedelta(days=1)
+    with multiprocessing.Pool(processes) as pool:
+        for chunk in pool.imap(_chunk, chunks):
+            yield from chunk
+
+
+def write(rows, f, format="csv"):
+    """
+    Write rows to the file f as CSV (with a header) or JSON Lines. Returns
+    the number of rows.
+    """
+    count = 0
+    writer = None
+    for row in rows:
+        if format == "jsonl":
+            f.write(json.dumps(row) + "\n")
+        else:
+            if writer is None:
+                writer = csv.DictWriter(f, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export the daily sun and moon events over a range of dates"
+    )
+    parser.add_argument("--lat", type=float, required=True, help="latitude")
+    parser.add_argument("--lon", type=float, required=True, help="longitude")
+    parser.add_argument("--first", required=True, help="first date, YYYY-MM-DD")
+    parser.add_argument("--last", required=True, help="last date, YYYY-MM-DD")
+    parser.add_argument("--format", choices=FORMATS, help="default from --output")
+    parser.add_argument(
+        "--processes", type=int, help="number of processes, default all cores"
+    )
+    parser.add_argument("--home", help="plugin folder with event tables")
+    parser.add_argument("--output", default="-", help="output file, - for stdout")
+    args = parser.parse_args(argv)
+    first = datetime.datetime.strptime(args.first, "%Y-%m-%d").date()
+    last = datetime.datetime.strptime(args.last, "%Y-%m-%d").date()
+    format = args.format
+    if format is None:
+        format = "jsonl" if args.output.endswith(".jsonl") else "csv"
+    standalone.verbose = {"Error"}
+    events = rows(args.lat, args.lon, first, last, args.home, args.processes)
+    if args.output == "-":
+        count = write(events, sys.stdout, format)
+    else:
+        with open(args.output, "w", newline="") as f:
+            count = write(events, f, format)
+    print("{} days".format(count), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
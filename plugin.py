@@ -4,6 +4,35 @@
 """
 <plugin key="xfr_sunmoon" name="SunMoon" author="Xorfor" version="1.1.0">
     <params>
+        <param field="Address" label="Other locations" width="300px"/>
+        <param field="Port" label="Shared cache" width="75px">
+            <options>
+                <option label="Off" value="0" default="true"/>
+                <option label="On" value="1"/>
+            </options>
+        </param>
+        <param field="Username" label="Facades" width="300px"/>
+        <param field="Mode1" label="Update interval (min)" width="75px" default="1"/>
+        <param field="Mode2" label="Position step (°)" width="75px"/>
+        <param field="Mode3" label="Write policy" width="150px">
+            <options>
+                <option label="All changes" value="All" default="true"/>
+                <option label="Deadband" value="Deadband"/>
+            </options>
+        </param>
+        <param field="Mode4" label="Computation" width="150px">
+            <options>
+                <option label="Heartbeat" value="Heartbeat" default="true"/>
+                <option label="Worker thread" value="Worker"/>
+            </options>
+        </param>
+        <param field="Mode5" label="Statistics" width="150px">
+            <options>
+                <option label="Off" value="Off" default="true"/>
+                <option label="Log" value="Log"/>
+                <option label="Log and file" value="File"/>
+            </options>
+        </param>
         <param field="Mode6" label="Debug" width="75px">
             <options>
                 <option label="True" value="Debug"/>
@@ -15,8 +44,16 @@
 """
 import Domoticz
 import datetime
-from math import degrees as deg
+import heapq
+import json
+from math import acos, cos, degrees as deg, exp, isfinite, pi, sin
+import os
+import queue
 import sys
+import threading
+import time
+from array import array
+from collections import deque
 from enum import IntEnum, unique  # , auto
 
 try:
@@ -24,6 +61,19 @@ try:
 except:
     pass
 
+# Also defines the horizons and quarters of the plugin
+import eventtable
+
+try:
+    import sharedcache
+except:
+    pass
+
+try:
+    import solar
+except:
+    pass
+
 
 @unique
 class used(IntEnum):
@@ -110,6 +160,504 @@ class unit(IntEnum):
     MOON_NEXT_FULL = 28
     MOON_NEXT_LAST_QUARTER = 29
     MOON_ILLUMINATION = 30
+    #
+    DAYLIGHT = 31
+    CIVIL_TWILIGHT = 32
+    NAUTICAL_TWILIGHT = 33
+    ASTRONOMICAL_TWILIGHT = 34
+    NIGHT = 35
+    MOON_UP = 36
+    #
+    IRRADIANCE = 37
+    NEXT_EQUINOX = 38
+    NEXT_SOLSTICE = 39
+    NEXT_PERIHELION = 40
+    NEXT_APHELION = 41
+    NEXT_SUPERMOON = 42
+    ECLIPSE_SEASON = 43
+    # Per facade an incidence and a switch, the next facade 2 units further
+    FACADE_INCIDENCE = 44
+    FACADE_SUN = 45
+
+
+@unique
+class crossing(IntEnum):
+    """
+    How the Sun crosses a horizon on a day
+        crossing.NORMAL, it rises and sets
+        crossing.NEVER_RISES, it stays below the horizon, eg. polar night
+        crossing.NEVER_SETS, it stays above the horizon, eg. midnight sun
+        crossing.NO_TWILIGHT, it stays above a twilight horizon, eg. white nights
+    """
+
+    NORMAL = 0
+    NEVER_RISES = 1
+    NEVER_SETS = 2
+    NO_TWILIGHT = 3
+
+
+class location:
+    """
+    A location of which the devices are updated: its name, its coordinates
+    (strings, as in the Domoticz settings), the offset added to the unit
+    numbers of its devices, and its ephem objects, which are created by the
+    plugin in the thread which computes.
+    """
+
+    def __init__(self, name, lat, lon, offset):
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.offset = offset
+        self.observer = None
+        self.sun = None
+        self.moon = None
+        self.twilight = None
+        self.sunTrajectory = None
+        self.moonTrajectory = None
+        self.irradiance = None
+
+
+class timings:
+    """
+    Rolling timing statistics per section of the heartbeat. Per section the
+    durations of the last calls are kept, together with the total number of
+    calls, device updates and actual device writes.
+    """
+
+    def __init__(self, window):
+        self.__window = window
+        self.__sections = {}
+
+    def add(self, section, seconds, updates=0, writes=0):
+        s = self.__section(section)
+        s["durations"].append(seconds)
+        s["calls"] += 1
+        s["updates"] += updates
+        s["writes"] += writes
+
+    def addWrites(self, section, writes):
+        # Writes of a section which are done later, eg. by the plugin thread
+        # for a job in the worker thread
+        self.__section(section)["writes"] += writes
+
+    def __section(self, section):
+        if section not in self.__sections:
+            self.__sections[section] = {
+                "durations": deque(maxlen=self.__window),
+                "calls": 0,
+                "updates": 0,
+                "writes": 0,
+            }
+        return self.__sections[section]
+
+    def summary(self):
+        result = {}
+        for section, s in sorted(self.__sections.items()):
+            durations = sorted(s["durations"])
+            if not durations:
+                continue
+            result[section] = {
+                "calls": s["calls"],
+                "min": durations[0],
+                "avg": sum(durations) / len(durations),
+                "p95": durations[int(0.95 * (len(durations) - 1))],
+                "max": durations[-1],
+                "updates": s["updates"],
+                "writes": s["writes"],
+            }
+        return result
+
+
+class trajectory:
+    """
+    Rolling samples of the position of a body at a fixed step, covering at
+    least span ahead. Positions in between are interpolated with a cubic
+    through the four surrounding samples. Each interval is validated once,
+    by computing a few positions within it directly; positions in an
+    interval whose interpolation error exceeds the bound (in degrees) are
+    not served.
+    """
+
+    # Positions within an interval, as fraction of the step, which are checked
+    __CHECKS = (0.25, 0.5, 0.75)
+
+    def __init__(self, observer, body, fields, step, span, bound):
+        self.__observer = observer
+        self.__body = body
+        self.__fields = fields
+        self.__step = step.total_seconds() / 86400
+        self.__count = int(span / step) + 4
+        self.__bound = bound
+        self.__start = None
+        self.__samples = [array("d") for _ in fields]
+        self.__valid = array("b")
+
+    def __compute(self, date):
+        self.__observer.date = date
+        self.__body.compute(self.__observer)
+        return [getattr(self.__body, field) for field in self.__fields]
+
+    def __append(self):
+        values = self.__compute(self.__start + len(self.__samples[0]) * self.__step)
+        for field, samples, value in zip(self.__fields, self.__samples, values):
+            if field == "az" and samples:
+                # Unwrap the azimuth, for interpolation across north
+                value += 2 * pi * round((samples[-1] - value) / (2 * pi))
+            samples.append(value)
+        # The interval before the previous sample can now be interpolated
+        k = len(self.__samples[0]) - 3
+        if k >= 1:
+            error = 0
+            for x in self.__CHECKS:
+                direct = self.__compute(self.__start + (k + x) * self.__step)
+                for field, value, interpolated in zip(
+                    self.__fields, direct, self.__interpolate(k, x)
+                ):
+                    if field in ("alt", "az"):
+                        difference = (deg(interpolated - value) + 180) % 360 - 180
+                        error = max(error, abs(difference))
+            self.__valid.append(error <= self.__bound)
+
+    def __interpolate(self, k, x):
+        # Cubic (Lagrange) through the samples k-1, k, k+1 and k+2
+        w = (
+            -x * (x - 1) * (x - 2) / 6,
+            (x + 1) * (x - 1) * (x - 2) / 2,
+            -(x + 1) * x * (x - 2) / 2,
+            (x + 1) * x * (x - 1) / 6,
+        )
+        return [
+            sum(w[i] * samples[k - 1 + i] for i in range(4))
+            for samples in self.__samples
+        ]
+
+    def __reset(self, start):
+        self.__start = start
+        for samples in self.__samples:
+            del samples[:]
+        self.__valid = array("b", [False])
+
+    def at(self, utc_now):
+        """
+        Interpolated values of the fields at utc_now, or None when the
+        interpolation is not within the bound.
+        """
+        date = ephem.Date(utc_now)
+        if (
+            self.__start is None
+            or date < self.__start + self.__step
+            or date > self.__start + len(self.__samples[0]) * self.__step
+        ):
+            self.__reset(date - self.__step)
+        # Drop the samples which are no longer needed. One more interval is
+        # kept, so a position somewhat before the last one is still served.
+        drop = int((date - self.__start) / self.__step) - 2
+        if drop > 0:
+            for samples in self.__samples:
+                del samples[:drop]
+            del self.__valid[:drop]
+            self.__start += drop * self.__step
+        while len(self.__samples[0]) < self.__count:
+            self.__append()
+        k = int((date - self.__start) / self.__step)
+        if not self.__valid[k]:
+            return None
+        values = self.__interpolate(k, (date - self.__start) / self.__step - k)
+        for i, field in enumerate(self.__fields):
+            if field == "az":
+                values[i] %= 2 * pi
+        return values
+
+
+class twilight:
+    """
+    Rising and setting of the Sun at several horizons, solved in one pass.
+    The position of the Sun is computed at a few instants over the day and
+    interpolated, and all crossings are solved on the interpolation in the
+    same way as ephem searches them. Each crossing is then refined with the
+    computed position of the Sun, until it is within ephem's precision.
+    """
+
+    # The Sun is computed at the start and twice this many days after it
+    __SAMPLE_STEP = 0.75
+    __ITERATIONS = 7
+    # Computations to refine a crossing, before falling back to ephem
+    __REFINEMENTS = 3
+    # Distance (radians) by which the culminations of the Sun have to miss a
+    # horizon, to skip searching its crossings
+    __MARGIN = 0.5 * pi / 180
+    # Sidereal days per solar day
+    __SIDEREAL = 1.00273790935
+    # Horizontal parallax of the Sun at 1 AU
+    __PARALLAX = 8.794 / 3600 * pi / 180
+
+    def __init__(self, observer, horizons):
+        self.__observer = observer.copy()
+        self.__fallback = observer.copy()
+        self.__pressure = observer.pressure
+        self.__temp = observer.temp
+        # Geometric positions, the refraction is applied to the horizon instead
+        self.__observer.pressure = 0
+        self.__horizons = [
+            (ephem.degrees(horizon), use_center) for horizon, use_center in horizons
+        ]
+        self.__sun = ephem.Sun()
+
+    def __compute(self, date):
+        self.__observer.date = date
+        self.__sun.compute(self.__observer)
+        return self.__sun
+
+    def __altitude(self, radius, horizon, use_center):
+        # Geometric altitude of the centre of the Sun when it crosses the horizon
+        if not use_center:
+            horizon -= radius
+        if self.__pressure:
+            horizon = ephem.unrefract(self.__pressure, self.__temp, horizon)
+        return horizon
+
+    def __polar(self, declinations, radius, horizon, use_center):
+        """
+        State of a horizon which the Sun clearly does not cross while its
+        declination stays within declinations, eg. during polar day or
+        night. None when it may cross it.
+        """
+        lat = float(self.__observer.lat)
+        alt = self.__altitude(radius, horizon, use_center)
+        if alt > max(pi / 2 - abs(lat - dec) for dec in declinations) + self.__MARGIN:
+            return crossing.NEVER_RISES
+        if alt < min(abs(lat + dec) - pi / 2 for dec in declinations) - self.__MARGIN:
+            return crossing.NEVER_SETS
+        return None
+
+    def __target(self, dec, radius, horizon, use_center, rising):
+        """
+        State and hour angle of the crossing of the horizon, for the Sun at
+        declination dec. When the Sun does not reach the horizon, the hour
+        angle of its culmination closest to it is used, as ephem does.
+        """
+        alt = self.__altitude(radius, horizon, use_center)
+        lat = self.__observer.lat
+        arg = (sin(alt) - sin(lat) * sin(dec)) / (cos(lat) * cos(dec))
+        if arg < -1:
+            state, ha = crossing.NEVER_SETS, pi
+        elif arg > 1:
+            state, ha = crossing.NEVER_RISES, 0
+        else:
+            state, ha = crossing.NORMAL, acos(arg)
+        return state, -ha if rising else ha
+
+    def __solve(self, start, position, horizon, use_center, rising):
+        # First crossing after start, on the interpolated positions
+        date = start
+        for i in range(self.__ITERATIONS):
+            ha, dec, radius = position(date)
+            _, target = self.__target(dec, radius, horizon, use_center, rising)
+            if i == 0:
+                bump = ((target - ha) % (2 * pi)) / (2 * pi)
+                if bump < ephem.default_newton_precision:
+                    bump += 1
+            else:
+                bump = ((target - ha + pi) % (2 * pi) - pi) / (2 * pi)
+            if abs(bump) < ephem.default_newton_precision:
+                break
+            date += bump
+        return date
+
+    def __refine(self, date, horizon, use_center, rising):
+        """
+        Crossing near date with the computed positions of the Sun, as date
+        and state. None when it does not converge quickly, eg. close to the
+        poles.
+        """
+        for _ in range(self.__REFINEMENTS):
+            sun = self.__compute(date)
+            state, target = self.__target(
+                sun.dec, sun.radius, horizon, use_center, rising
+            )
+            bump = ((target - sun.ha + pi) % (2 * pi) - pi) / (2 * pi)
+            if abs(bump) < ephem.default_newton_precision:
+                return ephem.Date(date), state
+            date += bump
+        return None
+
+    def __search(self, start, horizon, use_center, rising):
+        # Search of ephem itself
+        self.__fallback.date = start
+        self.__fallback.horizon = horizon
+        search = self.__fallback.next_rising if rising else self.__fallback.next_setting
+        try:
+            return search(self.__sun, use_center=use_center), crossing.NORMAL
+        except ephem.AlwaysUpError:
+            return None, crossing.NEVER_SETS
+        except ephem.NeverUpError:
+            return None, crossing.NEVER_RISES
+
+    def day(self, start, indices=None):
+        """
+        Crossings of the Sun, searched from start (00:00 UTC of a day, just
+        like the plugin searches the daily events), per horizon as (rising,
+        setting, state). Rising or setting is None when there is no time
+        available, the state tells why. Only the horizons with the given
+        indices are solved, the others are None. The first horizon is the one
+        of sunrise and sunset: a lower horizon the Sun stays above is only a
+        night without twilight when the Sun sets, otherwise the Sun never
+        sets, and the first horizon is solved too to know.
+        """
+        if indices is None:
+            indices = range(len(self.__horizons))
+        start = ephem.Date(start)
+        # Geocentric positions, which change smoothly over the day
+        ra = []
+        dec = []
+        for k in range(3):
+            sun = self.__compute(start + k * self.__SAMPLE_STEP)
+            if k == 0:
+                sidereal = float(self.__observer.sidereal_time())
+            value = float(sun.g_ra)
+            if ra:
+                # Unwrap the right ascension, for interpolation across 0h
+                value += 2 * pi * round((ra[-1] - value) / (2 * pi))
+            ra.append(value)
+            dec.append(float(sun.g_dec))
+        declinations = list(dec)
+        # Quadratic through the samples, with its first and second differences
+        ra = (ra[0], ra[1] - ra[0], ra[2] - 2 * ra[1] + ra[0])
+        dec = (dec[0], dec[1] - dec[0], dec[2] - 2 * dec[1] + dec[0])
+        # Hardly changing over the day
+        parallax = self.__PARALLAX / sun.earth_distance
+        radius = float(sun.radius)
+        lat = float(self.__observer.lat)
+
+        def position(date):
+            u = (date - start) / self.__SAMPLE_STEP
+            ra_u = ra[0] + u * (ra[1] + (u - 1) * ra[2] / 2)
+            dec_u = dec[0] + u * (dec[1] + (u - 1) * dec[2] / 2)
+            ha = sidereal + 2 * pi * self.__SIDEREAL * (date - start) - ra_u
+            # Topocentric hour angle and declination, corrected for parallax
+            ha += parallax * cos(lat) * sin(ha) / cos(dec_u)
+            dec_u -= parallax * (
+                sin(lat) * cos(dec_u) - cos(lat) * sin(dec_u) * cos(ha)
+            )
+            return ha, dec_u, radius
+
+        def solve(i):
+            horizon, use_center = self.__horizons[i]
+            day = self.__polar(declinations, radius, horizon, use_center)
+            if day is not None:
+                # No need to search
+                return None, None, day
+            events = []
+            day = crossing.NORMAL
+            for rising in (True, False):
+                date = self.__solve(start, position, horizon, use_center, rising)
+                refined = self.__refine(date, horizon, use_center, rising)
+                if refined is None:
+                    refined = self.__search(start, horizon, use_center, rising)
+                date, state = refined
+                if state == crossing.NORMAL:
+                    events.append(date)
+                else:
+                    events.append(None)
+                    if day == crossing.NORMAL:
+                        day = state
+            return events[0], events[1], day
+
+        record = [None] * len(self.__horizons)
+        for i in indices:
+            record[i] = solve(i)
+        for i in indices:
+            rising, setting, day = record[i]
+            if i > 0 and day == crossing.NEVER_SETS:
+                if record[0] is None:
+                    record[0] = solve(0)
+                if record[0][2] != crossing.NEVER_SETS:
+                    record[i] = (rising, setting, crossing.NO_TWILIGHT)
+        return record
+
+
+class irradiance:
+    """
+    Clear-sky global horizontal irradiance and the incidence of the Sun on
+    facades, over a day. The position of the Sun is computed once for the
+    whole day at a fixed step, all at once with the solar position backend,
+    and the curves of the irradiance and of every facade are derived from
+    it. In between the curves are interpolated, so every facade only costs
+    an interpolation per update.
+    """
+
+    # Seconds between the samples of the curves
+    __STEP = 300
+    __EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self, lat, lon, facades):
+        self.__lat = float(lat)
+        self.__lon = float(lon)
+        # Normals of the facades, (east, north, up) from (azimuth, tilt)
+        self.__normals = [
+            (
+                sin(tilt * pi / 180) * sin(azimuth * pi / 180),
+                sin(tilt * pi / 180) * cos(azimuth * pi / 180),
+                cos(tilt * pi / 180),
+            )
+            for azimuth, tilt in facades
+        ]
+        # Not the numpy backend, numpy does not support the sub-interpreters
+        # in which Domoticz runs its plugins
+        self.__backend = solar.backend("ephem")
+        self.__start = None
+        self.__end = None
+
+    def __generate(self, start, end):
+        count = int((end - start) // self.__STEP) + 2
+        alts, azs, _ = self.__backend.position(
+            self.__lat,
+            self.__lon,
+            [start + k * self.__STEP for k in range(count)],
+        )
+        self.__irradiance = array("d")
+        self.__heights = array("d")
+        self.__cosines = [array("d") for _ in self.__normals]
+        for alt, az in zip(alts, azs):
+            alt = float(alt) * pi / 180
+            az = float(az) * pi / 180
+            # Direction of the Sun, (east, north, up)
+            sun = (cos(alt) * sin(az), cos(alt) * cos(az), sin(alt))
+            # Clear sky model of Haurwitz
+            if sun[2] > 0:
+                self.__irradiance.append(1098 * sun[2] * exp(-0.059 / sun[2]))
+            else:
+                self.__irradiance.append(0)
+            self.__heights.append(sun[2])
+            for normal, cosines in zip(self.__normals, self.__cosines):
+                cosines.append(sum(n * s for n, s in zip(normal, sun)))
+        self.__start = start
+        self.__end = end
+
+    def at(self, utc_now, start, end):
+        """
+        Irradiance (W/m²), the sine of the altitude of the Sun and the
+        cosines of the angles of incidence of the Sun on the facades at
+        utc_now, from the curves of the day from start to end (UTC). The Sun
+        shines on a facade when both the sine and its cosine are positive.
+        """
+        timestamp = (utc_now - self.__EPOCH).total_seconds()
+        start = (start - self.__EPOCH).total_seconds()
+        end = (end - self.__EPOCH).total_seconds()
+        if (start, end) != (self.__start, self.__end):
+            self.__generate(start, end)
+        k, x = divmod((timestamp - start) / self.__STEP, 1)
+        k = min(max(int(k), 0), len(self.__irradiance) - 2)
+
+        def interpolate(samples):
+            return samples[k] + x * (samples[k + 1] - samples[k])
+
+        return (
+            interpolate(self.__irradiance),
+            interpolate(self.__heights),
+            [interpolate(cosines) for cosines in self.__cosines],
+        )
 
 
 class BasePlugin:
@@ -117,22 +665,82 @@ class BasePlugin:
     __DEBUG_NONE = 0
     __DEBUG_ALL = 1
 
-    __HEARTBEATS2MIN = 6
+    # Default interval for the position updates
     __MINUTES = 1
+    # Adaptive position updates: minimum interval (the heartbeat), maximum
+    # interval and the time step used to estimate the angular rate of change
+    __STEP_MIN_INTERVAL = datetime.timedelta(seconds=10)
+    __STEP_MAX_INTERVAL = datetime.timedelta(minutes=15)
+    __RATE_PROBE = datetime.timedelta(minutes=1)
+    # Trajectories of the sun and the moon: step between the samples, time
+    # covered ahead and maximum interpolation error (°) of altitude and azimuth
+    __TRAJECTORY_STEP = datetime.timedelta(minutes=10)
+    __TRAJECTORY_SPAN = datetime.timedelta(hours=24)
+    __TRAJECTORY_BOUND = 0.005
 
     __SEC30 = datetime.timedelta(seconds=30)
     __D_FORMAT = "%Y-%m-%d"
     __T_FORMAT = "%H:%M"
     __DT_FORMAT = "{} {}".format(__D_FORMAT, __T_FORMAT)
 
+    # Statistics: report every number of heartbeats, over a window of calls
+    __STATS_HEARTBEATS = 360
+    __STATS_WINDOW = 360
+    __STATS_FILE = "sunmoon_stats.json"
+
+    # Warm start: cached events and last written values, kept over restarts
+    __STATE_FILE = "sunmoon_state.json"
+    # Cache of computed events, shared by the instances of the plugin
+    __SHARED_CACHE_FILE = "sunmoon_cache.sqlite"
+    __STATE_VERSION = 5
+
+    # Every location has its own range of this many units, the Domoticz
+    # location the first one. Units are at most 255.
+    __LOCATION_UNITS = 64
+    __MAX_LOCATIONS = 4
+    # Every facade has this many units, from FACADE_INCIDENCE on
+    __FACADE_UNITS = 2
+    __MAX_FACADES = 10
+
+    # Seconds to wait for the worker thread to stop, ticks waiting for the
+    # worker at most, and the time between restarts of a stopped worker
+    __WORKER_STOP_TIMEOUT = 10
+    __WORKER_QUEUE = 6
+    __WORKER_RESTART = datetime.timedelta(minutes=1)
+
     # Twilights, their horizons and whether to use the centre of the Sun or not
-    __TWILIGHTS = [("0", False), ("-6", True), ("-12", True), ("-18", True)]
+    __TWILIGHTS = eventtable.TWILIGHTS
+
+    # Device values of the rising and setting when the Sun does not cross a horizon
+    __CROSSING_DESCRIPTIONS = {
+        crossing.NEVER_RISES: "Sun down all day",
+        crossing.NEVER_SETS: "Sun up all day",
+        crossing.NO_TWILIGHT: "Twilight all night",
+    }
 
     # Device units
     __UNITS = [
-        # Unit, Name, Type, Subtype, Options, Used, image
-        [unit.SUN_RISE, "Sunrise", 243, 19, {}, used.YES, images.SUNRISE],
-        [unit.SUN_RISE_CIVIL, "Sunrise civil", 243, 19, {}, used.YES, images.SUNRISE],
+        # Unit, Name, Type, Subtype, Options, Used, image, Jobs which update it
+        [
+            unit.SUN_RISE,
+            "Sunrise",
+            243,
+            19,
+            {},
+            used.YES,
+            images.SUNRISE,
+            ("sun_events",),
+        ],
+        [
+            unit.SUN_RISE_CIVIL,
+            "Sunrise civil",
+            243,
+            19,
+            {},
+            used.YES,
+            images.SUNRISE,
+            ("sun_events",),
+        ],
         [
             unit.SUN_RISE_NAUTICAL,
             "Sunrise nautical",
@@ -141,6 +749,7 @@ class BasePlugin:
             {},
             used.YES,
             images.SUNRISE,
+            ("sun_events",),
         ],
         [
             unit.SUN_RISE_ASTRONOMICAL,
@@ -150,9 +759,19 @@ class BasePlugin:
             {},
             used.YES,
             images.SUNRISE,
+            ("sun_events",),
+        ],
+        [unit.SUN_SET, "Sunset", 243, 19, {}, used.YES, images.SUNSET, ("sun_events",)],
+        [
+            unit.SUN_SET_CIVIL,
+            "Sunset civil",
+            243,
+            19,
+            {},
+            used.YES,
+            images.SUNSET,
+            ("sun_events",),
         ],
-        [unit.SUN_SET, "Sunset", 243, 19, {}, used.YES, images.SUNSET],
-        [unit.SUN_SET_CIVIL, "Sunset civil", 243, 19, {}, used.YES, images.SUNSET],
         [
             unit.SUN_SET_NAUTICAL,
             "Sunset nautical",
@@ -161,6 +780,7 @@ class BasePlugin:
             {},
             used.YES,
             images.SUNSET,
+            ("sun_events",),
         ],
         [
             unit.SUN_SET_ASTRONOMICAL,
@@ -170,6 +790,7 @@ class BasePlugin:
             {},
             used.YES,
             images.SUNSET,
+            ("sun_events",),
         ],
         [
             unit.SUN_ALT,
@@ -179,6 +800,7 @@ class BasePlugin:
             {"Custom": "0;°"},
             used.YES,
             images.SUN,
+            ("sun_position",),
         ],
         [
             unit.SUN_AZ,
@@ -188,6 +810,7 @@ class BasePlugin:
             {"Custom": "0;°"},
             used.YES,
             images.SUN,
+            ("sun_position",),
         ],
         [
             unit.SUN_DIST,
@@ -197,8 +820,18 @@ class BasePlugin:
             {"Custom": "0;km"},
             used.YES,
             images.SUN,
+            ("sun_position",),
+        ],
+        [
+            unit.SUN_TRANSIT,
+            "Sun transit",
+            243,
+            19,
+            {},
+            used.YES,
+            images.SUN,
+            ("sun_events",),
         ],
-        [unit.SUN_TRANSIT, "Sun transit", 243, 19, {}, used.YES, images.SUN],
         [
             unit.DAY_LENGTH_M,
             "Day length",
@@ -207,11 +840,39 @@ class BasePlugin:
             {"Custom": "0;min"},
             used.YES,
             images.SUN,
+            ("sun_events",),
+        ],
+        [
+            unit.DAY_LENGTH_T,
+            "Daylength",
+            243,
+            19,
+            {},
+            used.YES,
+            images.SUN,
+            ("sun_events",),
         ],
-        [unit.DAY_LENGTH_T, "Daylength", 243, 19, {}, used.YES, images.SUN],
         #
-        [unit.MOON_RISE, "Moon rise", 243, 19, {}, used.YES, images.MOONRISE],
-        [unit.MOON_SET, "Moon set", 243, 19, {}, used.YES, images.MOONSET],
+        [
+            unit.MOON_RISE,
+            "Moon rise",
+            243,
+            19,
+            {},
+            used.YES,
+            images.MOONRISE,
+            ("moon_events",),
+        ],
+        [
+            unit.MOON_SET,
+            "Moon set",
+            243,
+            19,
+            {},
+            used.YES,
+            images.MOONSET,
+            ("moon_events",),
+        ],
         [
             unit.MOON_AZ,
             "Moon Azimuth",
@@ -220,6 +881,7 @@ class BasePlugin:
             {"Custom": "0;°"},
             used.YES,
             images.MOON,
+            ("moon_position",),
         ],
         [
             unit.MOON_ALT,
@@ -229,6 +891,7 @@ class BasePlugin:
             {"Custom": "0;°"},
             used.YES,
             images.MOON,
+            ("moon_position",),
         ],
         [
             unit.MOON_DIST,
@@ -238,9 +901,28 @@ class BasePlugin:
             {"Custom": "0;km"},
             used.YES,
             images.MOON,
+            ("moon_position",),
+        ],
+        [
+            unit.MOON_PHASE,
+            "Moon Phase",
+            243,
+            19,
+            {},
+            used.YES,
+            images.MOON,
+            ("moon_phase",),
+        ],
+        [
+            unit.MOON_NEXT_NEW,
+            "Next new moon",
+            243,
+            19,
+            {},
+            used.YES,
+            images.MOONNEW,
+            ("lunation",),
         ],
-        [unit.MOON_PHASE, "Moon Phase", 243, 19, {}, used.YES, images.MOON],
-        [unit.MOON_NEXT_NEW, "Next new moon", 243, 19, {}, used.YES, images.MOONNEW],
         [
             unit.MOON_NEXT_FIRST_QUARTER,
             "Next first quarter",
@@ -249,8 +931,18 @@ class BasePlugin:
             {},
             used.YES,
             images.MOONFIRSTQUARTER,
+            ("lunation",),
+        ],
+        [
+            unit.MOON_NEXT_FULL,
+            "Next full moon",
+            243,
+            19,
+            {},
+            used.YES,
+            images.MOONFULL,
+            ("lunation",),
         ],
-        [unit.MOON_NEXT_FULL, "Next full moon", 243, 19, {}, used.YES, images.MOONFULL],
         [
             unit.MOON_NEXT_LAST_QUARTER,
             "Next last quarter",
@@ -259,6 +951,7 @@ class BasePlugin:
             {},
             used.YES,
             images.MOONLASTQUARTER,
+            ("lunation",),
         ],
         [
             unit.MOON_ILLUMINATION,
@@ -268,8 +961,196 @@ class BasePlugin:
             {"Custom": "0;%"},
             used.YES,
             images.MOON,
+            ("moon_position", "moon_phase"),
+        ],
+        #
+        [
+            unit.DAYLIGHT,
+            "Daylight",
+            244,
+            73,
+            {},
+            used.YES,
+            images.SUN,
+            ("sun_switches",),
+        ],
+        [
+            unit.CIVIL_TWILIGHT,
+            "Civil twilight",
+            244,
+            73,
+            {},
+            used.YES,
+            images.SUNSET,
+            ("sun_switches",),
+        ],
+        [
+            unit.NAUTICAL_TWILIGHT,
+            "Nautical twilight",
+            244,
+            73,
+            {},
+            used.YES,
+            images.SUNSET,
+            ("sun_switches",),
+        ],
+        [
+            unit.ASTRONOMICAL_TWILIGHT,
+            "Astronomical twilight",
+            244,
+            73,
+            {},
+            used.YES,
+            images.SUNSET,
+            ("sun_switches",),
+        ],
+        [
+            unit.NIGHT,
+            "Night",
+            244,
+            73,
+            {},
+            used.YES,
+            images.MOON,
+            ("sun_switches",),
+        ],
+        [
+            unit.MOON_UP,
+            "Moon above horizon",
+            244,
+            73,
+            {},
+            used.YES,
+            images.MOON,
+            ("moon_switch",),
+        ],
+        #
+        [
+            unit.IRRADIANCE,
+            "Clear sky irradiance",
+            243,
+            31,
+            {"Custom": "0;W/m²"},
+            used.YES,
+            images.SUN,
+            ("irradiance",),
+        ],
+        #
+        [
+            unit.NEXT_EQUINOX,
+            "Next equinox",
+            243,
+            19,
+            {},
+            used.YES,
+            images.SUN,
+            ("seasons",),
+        ],
+        [
+            unit.NEXT_SOLSTICE,
+            "Next solstice",
+            243,
+            19,
+            {},
+            used.YES,
+            images.SUN,
+            ("seasons",),
+        ],
+        [
+            unit.NEXT_PERIHELION,
+            "Next perihelion",
+            243,
+            19,
+            {},
+            used.YES,
+            images.SUN,
+            ("seasons",),
+        ],
+        [
+            unit.NEXT_APHELION,
+            "Next aphelion",
+            243,
+            19,
+            {},
+            used.YES,
+            images.SUN,
+            ("seasons",),
+        ],
+        [
+            unit.NEXT_SUPERMOON,
+            "Next supermoon",
+            243,
+            19,
+            {},
+            used.YES,
+            images.MOONFULL,
+            ("seasons",),
+        ],
+        [
+            unit.ECLIPSE_SEASON,
+            "Eclipse season",
+            243,
+            19,
+            {},
+            used.YES,
+            images.MOON,
+            ("seasons",),
         ],
     ]
+    # Switches of the periods of the day, with the twilight horizon (index in
+    # __TWILIGHTS) the Sun is above and the one it is below during the period
+    __DAY_SWITCHES = [
+        (unit.DAYLIGHT, 0, None),
+        (unit.CIVIL_TWILIGHT, 1, 0),
+        (unit.NAUTICAL_TWILIGHT, 2, 1),
+        (unit.ASTRONOMICAL_TWILIGHT, 3, 2),
+        (unit.NIGHT, None, 3),
+    ]
+    # Switches change this long after their event, when it has surely passed
+    __SWITCH_DELAY = datetime.timedelta(seconds=1)
+    # Jobs which do not depend on the location. These run once for all
+    # locations, the other jobs run per location.
+    __SHARED_JOBS = ("lunation", "moon_phase", "seasons")
+    # Principal moon phases and the ephem functions to search for them
+    __QUARTERS = [(2 * i, name) for i, name in enumerate(eventtable.QUARTERS)]
+    # Every principal phase occurs at least this often
+    __QUARTER_MIN_PERIOD = 29  # days
+    # While the Moon stays above or below the horizon, its rising or setting is
+    # searched from later starts, this far apart, up to the search window
+    __MOON_SEARCH_STEP = 0.125  # days
+    __MOON_SEARCH_WINDOW = 30  # days
+    # A full moon is a supermoon when the Moon is closer than this, searched
+    # over at most this many full moons
+    __SUPERMOON_DISTANCE = 360000  # km
+    __SUPERMOON_LUNATIONS = 30
+    # Eclipse season: the Sun is within the limit of a node of the orbit of the
+    # Moon. The Sun moves away from a node at the node rate (radians per day).
+    __ECLIPSE_LIMIT = 18 * pi / 180
+    __NODE_RATE = (360 / 365.2422 + 360 / 6798.38) * pi / 180
+    # Names of the seasons of the equinoxes and solstices, per month, in the
+    # northern and the southern hemisphere
+    __SEASONS = {
+        3: ("spring", "autumn"),
+        6: ("summer", "winter"),
+        9: ("autumn", "spring"),
+        12: ("winter", "summer"),
+    }
+    # Write policies, used when the Deadband write policy is selected. A device
+    # is only written when its value has changed more than the deadband and the
+    # minimum time between writes has passed.
+    __WRITE_POLICIES = [
+        # Unit, Absolute deadband, Relative deadband, Minimum seconds between writes
+        [unit.SUN_ALT, 0.1, None, 60],
+        [unit.SUN_AZ, 0.1, None, 60],
+        [unit.SUN_DIST, None, 0.00001, 600],
+        [unit.MOON_ALT, 0.1, None, 60],
+        [unit.MOON_AZ, 0.1, None, 60],
+        [unit.MOON_DIST, None, 0.0001, 600],
+        [unit.MOON_ILLUMINATION, 0.5, None, 600],
+        [unit.IRRADIANCE, 1, None, 60],
+    ]
+    # Write policy of the incidence of every facade
+    __FACADE_WRITE_POLICY = (0.1, None, 60)
     __MOON_PHASE_DESCRIPTIONS = [
         "New moon",
         "Waxing crescent",
@@ -282,12 +1163,1326 @@ class BasePlugin:
     ]
 
     def __init__(self):
-        self.__runAgain = 0
+        # Scheduler: heap of (due time in UTC, job name)
+        self.__schedule = []
+        self.__interval = datetime.timedelta(minutes=self.__MINUTES)
+        self.__step = None
+        # Write policies per unit, the last written values and their time
+        self.__writePolicies = {}
+        self.__shadow = {}
+        self.__suppressedWrites = 0
+        self.__updates = 0
+        self.__written = 0
+        # Heartbeat statistics, None when switched off
+        self.__timings = None
+        self.__statsFile = None
+        self.__ticks = 0
+        # Worker thread: ticks to compute, device updates and job timings to
+        # apply. While the worker runs the jobs, their device updates are
+        # collected in output, with the job (section) they are from. Only the
+        # plugin thread adds to the timings and counts the writes.
+        self.__worker = None
+        self.__workerStarted = None
+        self.__tasks = queue.Queue(self.__WORKER_QUEUE)
+        self.__results = queue.Queue()
+        self.__output = None
+        self.__section = None
+        # Units of the devices which are present and used, refreshed every
+        # heartbeat. Only these are computed.
+        self.__present = frozenset()
+        # Units per scheduled job, (job name, location index) -> units. The
+        # location index of a shared job is None.
+        self.__jobUnits = {}
+        # Phase index of the Moon, set by the moon phase job
+        self.__phase = None
+        # Daily event cache: (local date, lat, lon, kind) -> events
+        self.__dailyEvents = {}
+        # Lunation cache: phase -> (previous, next) instant of that phase
+        self.__lunationCache = {}
+        # Seasonal event cache: name -> (since, until, value), the value is
+        # valid from since until until, eg. until the event has passed
+        self.__seasonCache = {}
+        # Moon event cache: (lat, lon, field) -> next rising or setting
+        self.__moonEvents = {}
+        # Precomputed event tables: year -> EventTable, None if not available
+        self.__eventTables = {}
+        # Cache file shared with other instances, None when not configured
+        self.__sharedCache = None
+        # Locations and facades, (name, azimuth, tilt), set by onStart
+        self.__locations = []
+        self.__facades = []
+        # Unit table, with the units of the facades
+        self.__units = self.__UNITS
         if "ephem" in sys.modules:
             self.__ephem_exist = True
         else:
             self.__ephem_exist = False
 
+    def __sunDay(self, loc, target_date, indices):
+        """
+        Rising, setting and crossing state of the Sun for target_date at the
+        twilight horizons with the given indices, None for the others. Solved
+        once per local day, after that served from the daily event cache.
+        None means no time available.
+        """
+        keys = [(target_date, loc.lat, loc.lon, ("twilight", i)) for i in indices]
+        missing = [i for i, key in zip(indices, keys) if key not in self.__dailyEvents]
+        if missing:
+            # Only keep the events of the days around it, and the sun transits
+            for k in [
+                k
+                for k in self.__dailyEvents
+                if k[0] is not None and abs((k[0] - target_date).days) > 2
+            ]:
+                del self.__dailyEvents[k]
+            day = None
+            record = self.__dayEvents(loc, target_date)
+            if record is not None:
+                day = [
+                    (
+                        record[eventtable.SUN_RISE + i],
+                        record[eventtable.SUN_SET + i],
+                        crossing.NORMAL,
+                    )
+                    for i in range(len(self.__TWILIGHTS))
+                ]
+                # The table has no state when there is no time available
+                if any(None in day[i] for i in missing):
+                    day = None
+            if day is None:
+                day = self.__sharedSunDay(loc, target_date, missing)
+            for i in missing:
+                rising, setting, state = day[i]
+                Domoticz.Debug(
+                    "Sun events {} {} (horizon {}): {} - {} ({})".format(
+                        loc.name,
+                        target_date,
+                        self.__TWILIGHTS[i][0],
+                        rising,
+                        setting,
+                        state.name,
+                    )
+                )
+                self.__dailyEvents[keys[indices.index(i)]] = day[i]
+        day = [None] * len(self.__TWILIGHTS)
+        for i, key in zip(indices, keys):
+            day[i] = self.__dailyEvents[key]
+        return day
+
+    def __sharedSunDay(self, loc, target_date, indices):
+        """
+        Sun events of the horizons with the given indices, from the shared
+        cache, and solved when they are not in there. Solved events are
+        published to the shared cache.
+        """
+        day = [None] * len(self.__TWILIGHTS)
+        solve = []
+        for i in indices:
+            value = self.__sharedGet(
+                "sun", target_date, loc.lat, loc.lon, self.__TWILIGHTS[i][0]
+            )
+            if value is None:
+                solve.append(i)
+            else:
+                day[i] = self.__unpackSunEvents(value)
+        if solve:
+            solved = loc.twilight.day(target_date, solve)
+            for i in solve:
+                day[i] = solved[i]
+                self.__sharedPut(
+                    self.__packSunEvents(day[i]),
+                    "sun",
+                    target_date,
+                    loc.lat,
+                    loc.lon,
+                    self.__TWILIGHTS[i][0],
+                )
+        return day
+
+    def __packSunEvents(self, events):
+        # Rising, setting and crossing state as JSON value
+        rising, setting, day = events
+        return [
+            None if rising is None else float(rising),
+            None if setting is None else float(setting),
+            day.value,
+        ]
+
+    def __unpackSunEvents(self, value):
+        rising, setting, day = value
+        return (
+            None if rising is None else ephem.Date(rising),
+            None if setting is None else ephem.Date(setting),
+            crossing(day),
+        )
+
+    def __sharedGet(self, quantity, date=None, lat=None, lon=None, horizon=None):
+        """
+        Entry of the shared cache. None when it is not in there, or when
+        there is no shared cache.
+        """
+        if self.__sharedCache is None:
+            return None
+        try:
+            return self.__sharedCache.get(quantity, date, lat, lon, horizon)
+        except sharedcache.Error as e:
+            Domoticz.Error("Unable to read shared cache: {}".format(e))
+            return None
+
+    def __sharedPut(self, value, quantity, date=None, lat=None, lon=None, horizon=None):
+        if self.__sharedCache is None:
+            return
+        try:
+            self.__sharedCache.put(quantity, date, lat, lon, horizon, value)
+        except sharedcache.Error as e:
+            Domoticz.Error("Unable to write shared cache: {}".format(e))
+
+    def __moonEvent(self, loc, utc_now, field):
+        """
+        Next rising (field MOON_RISE) or setting (MOON_SET) of the Moon at a
+        location. Kept until it has passed. None when there is none within
+        the search window.
+        """
+        key = (loc.lat, loc.lon, field)
+        event = self.__moonEvents.get(key)
+        if event is None or event <= ephem.Date(utc_now):
+            event = self.__nextDayEvent(loc, utc_now, field)
+            if event is None:
+                event = self.__searchMoonEvent(loc, utc_now, field)
+            Domoticz.Debug("Moon event {} {}: {}".format(loc.name, field, event))
+            self.__moonEvents[key] = event
+        return self.__moonEvents[key]
+
+    def __searchMoonEvent(self, loc, utc_now, field):
+        """
+        Search the next rising or setting of the Moon. When the Moon stays
+        above or below the horizon, eg. at high latitudes, ephem raises an
+        error and the search is repeated from a later start.
+        """
+        if field == "MOON_RISE":
+            search = loc.observer.next_rising
+        else:
+            search = loc.observer.next_setting
+        now = ephem.Date(utc_now)
+        start = now
+        while start < now + self.__MOON_SEARCH_WINDOW:
+            try:
+                return search(loc.moon, start=start)
+            except (ephem.AlwaysUpError, ephem.NeverUpError):
+                start += self.__MOON_SEARCH_STEP
+        return None
+
+    def __sunTransit(self, loc, utc_now):
+        """
+        Next transit of the Sun at a location. Kept in the daily event cache
+        until it has passed.
+        """
+        key = (None, loc.lat, loc.lon, "transit")
+        transit = self.__dailyEvents.get(key)
+        if transit is None or transit <= ephem.Date(utc_now):
+            transit = self.__nextDayEvent(loc, utc_now, "SUN_TRANSIT")
+            if transit is None:
+                loc.observer.date = utc_now
+                transit = loc.observer.next_transit(loc.sun)
+            self.__dailyEvents[key] = transit
+        return transit
+
+    def __eventTable(self, year):
+        """
+        Event table of a year in the plugin folder. None when there is no
+        table, or when it is for none of the locations.
+        """
+        if year not in self.__eventTables:
+            table = None
+            path = os.path.join(Parameters["HomeFolder"], eventtable.filename(year))
+            if os.path.exists(path):
+                try:
+                    table = eventtable.EventTable(path)
+                except (OSError, ValueError) as e:
+                    Domoticz.Error("Unable to read event table: {}".format(e))
+            if table is not None and not any(
+                table.matches(loc.lat, loc.lon) for loc in self.__locations
+            ):
+                Domoticz.Log("Event table {} is for another location".format(path))
+                table.close()
+                table = None
+            self.__eventTables[year] = table
+        return self.__eventTables[year]
+
+    def __dayEvents(self, loc, date):
+        """
+        Precomputed events of date from the event table of its year in the
+        plugin folder. None when there is no table for this location.
+        """
+        table = self.__eventTable(date.year)
+        if table is None or not table.matches(loc.lat, loc.lon):
+            return None
+        return table.record(date)
+
+    def __nextDayEvent(self, loc, utc_now, field):
+        """
+        First event of a field of the event table after utc_now. None when
+        it is not in the table.
+        """
+        now = ephem.Date(utc_now)
+        for days in (0, 1):
+            record = self.__dayEvents(
+                loc, utc_now.date() + datetime.timedelta(days=days)
+            )
+            if record is None:
+                return None
+            event = record[getattr(eventtable, field)]
+            if event is not None and event > now:
+                return event
+        return None
+
+    def __lunation(self, utc_now):
+        """
+        Previous and next instant of the new moon, first quarter, full moon
+        and last quarter, indexed by their phase number (0, 2, 4 and 6). A
+        phase is only searched again after its next instant has passed. These
+        are the same for every location, and are shared with other instances
+        through the shared cache.
+        """
+        now = ephem.Date(utc_now)
+        for phase, name in self.__QUARTERS:
+            previous, upcoming = self.__lunationCache.get(phase, (None, None))
+            if upcoming is not None and previous <= now < upcoming:
+                continue
+            if upcoming is None:
+                # The quarters of any event table will do
+                table = self.__eventTable(utc_now.year)
+                record = None if table is None else table.record(utc_now.date())
+                if record is not None:
+                    i = self.__QUARTERS.index((phase, name))
+                    previous = record[eventtable.QUARTER_PREVIOUS + 2 * i]
+                    upcoming = record[eventtable.QUARTER_NEXT + 2 * i]
+                    if previous <= now < upcoming:
+                        self.__lunationCache[phase] = (previous, upcoming)
+                        continue
+                    upcoming = None
+            # Another instance may have searched it already
+            value = self.__sharedGet(name)
+            if value is not None and value[0] <= now < value[1]:
+                self.__lunationCache[phase] = (
+                    ephem.Date(value[0]),
+                    ephem.Date(value[1]),
+                )
+                continue
+            if upcoming is not None and 0 <= now - upcoming < self.__QUARTER_MIN_PERIOD:
+                # The passed event is the most recent one
+                previous = upcoming
+            else:
+                previous = getattr(ephem, "previous_" + name)(now)
+            upcoming = getattr(ephem, "next_" + name)(now)
+            Domoticz.Debug("Lunation {}: {} - {}".format(name, previous, upcoming))
+            self.__lunationCache[phase] = (previous, upcoming)
+            self.__sharedPut([float(previous), float(upcoming)], name)
+        return self.__lunationCache
+
+    def __moonPhase(self, utc_now, target_date, lunation):
+        """
+        Phase index (0-7) of the Moon. A principal phase (new, first quarter,
+        full, last quarter) is used for the whole local day on which it
+        occurs. Otherwise the phase follows from the difference in ecliptic
+        longitude between the Moon and the Sun, just as ephem uses to search
+        for the principal phases. The positions are geocentric, so the phase
+        is the same for every location.
+        """
+        for phase, _ in self.__QUARTERS:
+            if target_date in [ephem.localtime(d).date() for d in lunation[phase]]:
+                return phase
+        loc = self.__locations[0]
+        loc.observer.date = utc_now
+        loc.sun.compute(loc.observer)
+        loc.moon.compute(loc.observer)
+        sun_lon = ephem.Ecliptic(
+            ephem.Equatorial(loc.sun.g_ra, loc.sun.g_dec, epoch=utc_now)
+        ).lon
+        moon_lon = ephem.Ecliptic(
+            ephem.Equatorial(loc.moon.g_ra, loc.moon.g_dec, epoch=utc_now)
+        ).lon
+        elongation = (moon_lon - sun_lon) % (2 * pi)
+        # Waxing crescent, waxing gibbous, waning gibbous or waning crescent
+        return 2 * int(elongation // (pi / 2)) + 1
+
+    def __seasons(self, utc_now):
+        """
+        Equinox, solstice, perihelion, aphelion, supermoon and eclipse season,
+        as lists of ephem dates (and a distance for the supermoon). These do
+        not depend on the location. Each is only searched again when it is no
+        longer valid, eg. after its event has passed, so only a few times a
+        year.
+        """
+        now = ephem.Date(utc_now)
+        searches = {
+            "equinox": lambda: self.__nextEvent(ephem.next_equinox(now)),
+            "solstice": lambda: self.__nextEvent(ephem.next_solstice(now)),
+            "perihelion": lambda: self.__nextEvent(self.__sunDistanceExtreme(now, 1)),
+            "aphelion": lambda: self.__nextEvent(self.__sunDistanceExtreme(now, -1)),
+            "supermoon": lambda: self.__nextSupermoon(now),
+            "eclipse_season": lambda: self.__eclipseSeason(now),
+        }
+        for name, search in searches.items():
+            since, until, value = self.__seasonCache.get(name, (None, None, None))
+            if since is not None and since <= now < until:
+                continue
+            until, value = search()
+            Domoticz.Debug("Season {}: {} until {}".format(name, value, until))
+            self.__seasonCache[name] = (now, until, value)
+        return {name: value for name, (_, _, value) in self.__seasonCache.items()}
+
+    def __nextEvent(self, event):
+        # An event, valid until it has passed
+        return event, [event]
+
+    def __sunDistanceExtreme(self, now, sign):
+        """
+        Next perihelion (sign 1) or aphelion (sign -1), when the distance of
+        the Earth to the Sun is smallest or largest. ephem has no function
+        for these. The day of the extreme is found by stepping a day at a
+        time, the instant by fitting a parabola to hourly distances over a
+        day around it, as ephem has the distance in single precision only,
+        which is flat for hours around the extreme.
+        """
+        sun = ephem.Sun()
+
+        def distance(date):
+            sun.compute(ephem.Date(date))
+            return sign * sun.earth_distance
+
+        # Whole days from 12:00 UTC, so the result does not depend on now
+        date = ephem.Date(int(now))
+        previous, current, following = (
+            distance(date - 1),
+            distance(date),
+            distance(date + 1),
+        )
+        while not previous > current <= following:
+            date += 1
+            previous, current, following = current, following, distance(date + 1)
+        # Least squares fit of a + b * x + c * x ** 2, the sums of odd powers
+        # of x are 0
+        xs = [hour / 24 for hour in range(-24, 25)]
+        ys = [distance(date + x) for x in xs]
+        n = len(xs)
+        s2 = sum(x**2 for x in xs)
+        s4 = sum(x**4 for x in xs)
+        b = sum(x * y for x, y in zip(xs, ys)) / s2
+        c = (n * sum(x**2 * y for x, y in zip(xs, ys)) - s2 * sum(ys)) / (
+            n * s4 - s2**2
+        )
+        event = ephem.Date(date - b / (2 * c))
+        if event <= now:
+            # The extreme has just passed, search the next one
+            return self.__sunDistanceExtreme(ephem.Date(now + 2), sign)
+        return event
+
+    def __nextSupermoon(self, now):
+        """
+        Next full moon at which the Moon is closer than the supermoon
+        distance, with that distance (km). Valid until it has passed.
+        """
+        moon = ephem.Moon()
+        date = now
+        for _ in range(self.__SUPERMOON_LUNATIONS):
+            date = ephem.next_full_moon(date)
+            moon.compute(date)
+            distance = moon.earth_distance * ephem.meters_per_au / 1000
+            if distance < self.__SUPERMOON_DISTANCE:
+                return date, [date, distance]
+            date = ephem.Date(date + 1)
+        # None within the search, search again after the last full moon
+        return date, [None, None]
+
+    def __nodeDistance(self, date):
+        """
+        Ecliptic longitude of the Sun from the nearest node of the orbit of
+        the Moon (radians, -pi/2 to pi/2). It increases at about the node
+        rate.
+        """
+        sun = ephem.Sun()
+        sun.compute(date)
+        sun_lon = ephem.Ecliptic(
+            ephem.Equatorial(sun.g_ra, sun.g_dec, epoch=date), epoch=date
+        ).lon
+        # Mean longitude of the ascending node, after Meeus
+        t = (date - ephem.J2000) / 36525
+        node = (125.04452 - 1934.136261 * t) * pi / 180
+        return (sun_lon - node + pi / 2) % pi - pi / 2
+
+    def __nodeCrossing(self, date, target, direction):
+        # Next (direction 1) or previous (-1) instant the node distance is target
+        angle = (direction * (target - self.__nodeDistance(date))) % pi
+        date = ephem.Date(date + direction * angle / self.__NODE_RATE)
+        for _ in range(3):
+            error = (self.__nodeDistance(date) - target + pi / 2) % pi - pi / 2
+            date = ephem.Date(date - error / self.__NODE_RATE)
+        return date
+
+    def __eclipseSeason(self, now):
+        """
+        Start and end of the current eclipse season, or of the next one when
+        the Sun is not near a node. Valid until the season has ended.
+        """
+        if abs(self.__nodeDistance(now)) < self.__ECLIPSE_LIMIT:
+            start = self.__nodeCrossing(now, -self.__ECLIPSE_LIMIT, -1)
+        else:
+            start = self.__nodeCrossing(now, -self.__ECLIPSE_LIMIT, 1)
+        end = self.__nodeCrossing(start, self.__ECLIPSE_LIMIT, 1)
+        return end, [start, end]
+
+    def __parseLocations(self, text):
+        """
+        Other locations, from a comma separated list of name;latitude;longitude,
+        eg. "Office;51.92;4.48, Cabin;61.12;10.47". Every location gets the
+        next range of units.
+        """
+        locations = []
+        for entry in text.split(","):
+            if not entry.strip():
+                continue
+            fields = [field.strip() for field in entry.split(";")]
+            try:
+                name, lat, lon = fields
+                valid = name and abs(float(lat)) <= 90 and abs(float(lon)) <= 180
+            except ValueError:
+                valid = False
+            if not valid:
+                Domoticz.Error(
+                    "Invalid location '{}', use name;latitude;longitude".format(
+                        entry.strip()
+                    )
+                )
+            elif len(locations) + 1 >= self.__MAX_LOCATIONS:
+                Domoticz.Error("Too many locations, '{}' ignored".format(name))
+            else:
+                offset = (len(locations) + 1) * self.__LOCATION_UNITS
+                locations.append(location(name, lat, lon, offset))
+        return locations
+
+    def __parseFacades(self, text):
+        """
+        Facades, from a comma separated list of name;azimuth;tilt, eg.
+        "South;180;90, Roof;200;35". The azimuth is the direction the facade
+        faces, the tilt its angle with the ground, 90 when omitted.
+        """
+        facades = []
+        for entry in text.split(","):
+            if not entry.strip():
+                continue
+            fields = [field.strip() for field in entry.split(";")]
+            if len(fields) == 2:
+                # Vertical
+                fields.append("90")
+            try:
+                name, azimuth, tilt = fields
+                azimuth = float(azimuth) % 360
+                tilt = float(tilt)
+                valid = name and 0 <= tilt <= 180
+            except ValueError:
+                valid = False
+            if not valid:
+                Domoticz.Error(
+                    "Invalid facade '{}', use name;azimuth;tilt".format(entry.strip())
+                )
+            elif len(facades) >= self.__MAX_FACADES:
+                Domoticz.Error("Too many facades, '{}' ignored".format(name))
+            else:
+                facades.append((name, azimuth, tilt))
+        return facades
+
+    def __facadeUnits(self):
+        # Rows of the unit table for the facades
+        rows = []
+        for k, (name, _, _) in enumerate(self.__facades):
+            offset = k * self.__FACADE_UNITS
+            rows.append(
+                [
+                    unit.FACADE_INCIDENCE + offset,
+                    "{} incidence".format(name),
+                    243,
+                    31,
+                    {"Custom": "0;°"},
+                    used.YES,
+                    images.SUN,
+                    ("irradiance",),
+                ]
+            )
+            rows.append(
+                [
+                    unit.FACADE_SUN + offset,
+                    "Sun on {}".format(name),
+                    244,
+                    73,
+                    {},
+                    used.YES,
+                    images.SUN,
+                    ("irradiance",),
+                ]
+            )
+        return rows
+
+    def __wanted(self, *Units):
+        """
+        True when any of the units is present and used, and so has to be
+        computed.
+        """
+        return any(Unit in self.__present for Unit in Units)
+
+    def __updateDevice(self, Unit, nValue, sValue):
+        """
+        Device update from a job. Written directly, or applied by the plugin
+        thread when the job runs in the worker thread.
+        """
+        if Unit not in self.__present:
+            return
+        self.__updates += 1
+        if self.__output is None:
+            self.__writeDevice(Unit, nValue, sValue)
+        else:
+            self.__output.append(
+                (self.__section, self.__writeDevice, (Unit, nValue, sValue))
+            )
+
+    def __updateDeviceImage(self, Unit, Image):
+        if Unit not in self.__present:
+            return
+        if self.__output is None:
+            UpdateDeviceImage(Unit, Image)
+        else:
+            self.__output.append((self.__section, UpdateDeviceImage, (Unit, Image)))
+
+    def __writeDevice(self, Unit, nValue, sValue):
+        """
+        UpdateDevice, with the write policy of the unit applied. Suppressed
+        writes are counted.
+        """
+        utc_now = UtcNow()
+        policy = self.__writePolicies.get(Unit)
+        if policy is not None and Unit in self.__shadow:
+            absolute, relative, seconds = policy
+            value, written = self.__shadow[Unit]
+            deadband = max(absolute or 0, (relative or 0) * abs(value))
+            if (
+                abs(float(sValue) - value) < deadband
+                or (utc_now - written).total_seconds() < seconds
+            ):
+                self.__suppressedWrites += 1
+                return
+        if UpdateDevice(Unit, nValue, sValue):
+            self.__written += 1
+        if policy is not None:
+            self.__shadow[Unit] = (float(sValue), utc_now)
+
+    def __createEphem(self):
+        for loc in self.__locations:
+            self.__createLocationEphem(loc)
+
+    def __createLocationEphem(self, loc):
+        loc.observer = ephem.Observer()
+        loc.observer.lat = loc.lat
+        loc.observer.lon = loc.lon
+        loc.observer.date = UtcNow()
+        loc.sun = ephem.Sun()
+        loc.moon = ephem.Moon()
+        loc.twilight = twilight(loc.observer, self.__TWILIGHTS)
+        loc.sunTrajectory = trajectory(
+            loc.observer,
+            ephem.Sun(),
+            ("alt", "az", "earth_distance"),
+            self.__TRAJECTORY_STEP,
+            self.__TRAJECTORY_SPAN,
+            self.__TRAJECTORY_BOUND,
+        )
+        loc.moonTrajectory = trajectory(
+            loc.observer,
+            ephem.Moon(),
+            ("alt", "az", "earth_distance", "moon_phase"),
+            self.__TRAJECTORY_STEP,
+            self.__TRAJECTORY_SPAN,
+            self.__TRAJECTORY_BOUND,
+        )
+        loc.irradiance = irradiance(
+            loc.lat, loc.lon, [(azimuth, tilt) for _, azimuth, tilt in self.__facades]
+        )
+
+    def __sunPosition(self, loc, utc_now):
+        """
+        Altitude, azimuth and distance of the Sun at a location, from its
+        trajectory, or computed when the trajectory is not accurate enough.
+        """
+        position = loc.sunTrajectory.at(utc_now)
+        if position is None:
+            loc.observer.date = utc_now
+            loc.sun.compute(loc.observer)
+            position = [loc.sun.alt, loc.sun.az, loc.sun.earth_distance]
+        return position
+
+    def __moonPosition(self, loc, utc_now):
+        """
+        Altitude, azimuth, distance and phase of the Moon at a location, from
+        its trajectory, or computed when the trajectory is not accurate
+        enough.
+        """
+        position = loc.moonTrajectory.at(utc_now)
+        if position is None:
+            loc.observer.date = utc_now
+            loc.moon.compute(loc.observer)
+            position = [
+                loc.moon.alt,
+                loc.moon.az,
+                loc.moon.earth_distance,
+                loc.moon.moon_phase,
+            ]
+        return position
+
+    def __runJobs(self, utc_now):
+        """
+        Run only the jobs which are due, in order of their due time. The jobs
+        of all locations which are due run in the same tick. Every job runs
+        at most once per tick, a job which is due again runs at the next tick.
+        Returns the timings of the jobs, to be added by the plugin thread.
+        """
+        rescheduled = []
+        jobTimings = []
+        while self.__schedule and self.__schedule[0][0] <= utc_now:
+            due, name, index = heapq.heappop(self.__schedule)
+            if not self.__wanted(*self.__jobUnits[(name, index)]):
+                # None of its devices, check again after the update interval
+                rescheduled.append((utc_now + self.__interval, name, index))
+                continue
+            if self.__timings is not None:
+                started = time.perf_counter()
+                updates = self.__updates
+                # In the worker the writes are counted when they are applied
+                written = self.__written if self.__output is None else None
+            # A shared job updates all locations, the others their own location
+            args = () if index is None else (self.__locations[index],)
+            self.__section = name
+            try:
+                next_due = self.__JOBS[name](self, utc_now, *args)
+            except:
+                Domoticz.Error("Job {} failed: {}".format(name, sys.exc_info()[1]))
+                next_due = utc_now + self.__interval
+            rescheduled.append((max(next_due, utc_now), name, index))
+            if self.__timings is not None:
+                jobTimings.append(
+                    (
+                        name,
+                        time.perf_counter() - started,
+                        self.__updates - updates,
+                        0 if written is None else self.__written - written,
+                    )
+                )
+        for job in rescheduled:
+            heapq.heappush(self.__schedule, job)
+        if self.__schedule:
+            Domoticz.Debug(
+                "Next job {} at {}, {} writes suppressed".format(
+                    self.__schedule[0][1],
+                    self.__schedule[0][0],
+                    self.__suppressedWrites,
+                )
+            )
+        return jobTimings
+
+    def __startWorker(self):
+        # The worker thread creates and owns the ephem objects
+        self.__worker = threading.Thread(
+            name="SunMoon worker", target=self.__work, daemon=True
+        )
+        self.__workerStarted = UtcNow()
+        self.__worker.start()
+
+    def __work(self):
+        """
+        Worker thread. Runs the due jobs for every tick handed over by
+        onHeartbeat, and returns their device updates and timings. An error
+        which stops it is logged, onHeartbeat then restarts it.
+        """
+        try:
+            self.__createEphem()
+            while True:
+                utc_now = self.__tasks.get()
+                # Only the latest tick is of interest
+                while utc_now is not None and not self.__tasks.empty():
+                    utc_now = self.__tasks.get()
+                if utc_now is None:
+                    break
+                self.__output = []
+                jobTimings = []
+                try:
+                    jobTimings = self.__runJobs(utc_now)
+                finally:
+                    self.__results.put((self.__output, jobTimings))
+                    self.__output = None
+        except:
+            Domoticz.Error("Worker thread stopped: {}".format(sys.exc_info()[1]))
+
+    def __applyResults(self):
+        """
+        Apply the device updates of the worker. The timings of its jobs are
+        added here, and the writes are counted for the jobs they are from.
+        """
+        while not self.__results.empty():
+            output, jobTimings = self.__results.get()
+            for job in jobTimings:
+                self.__timings.add(*job)
+            for section, update, args in output:
+                written = self.__written
+                update(*args)
+                if self.__timings is not None and self.__written > written:
+                    self.__timings.addWrites(section, self.__written - written)
+
+    def __reportStatistics(self):
+        """
+        Log the heartbeat statistics and optionally write them to a JSON file
+        in the plugin folder.
+        """
+        summary = self.__timings.summary()
+        for section, s in summary.items():
+            Domoticz.Log(
+                "Statistics {}: {} calls, min/avg/p95/max {:.2f}/{:.2f}/{:.2f}/{:.2f} ms, {} updates, {} writes".format(
+                    section,
+                    s["calls"],
+                    s["min"] * 1000,
+                    s["avg"] * 1000,
+                    s["p95"] * 1000,
+                    s["max"] * 1000,
+                    s["updates"],
+                    s["writes"],
+                )
+            )
+        if self.__statsFile is not None:
+            try:
+                with open(self.__statsFile, "w") as f:
+                    json.dump(
+                        {
+                            "time": UtcNow().isoformat(),
+                            "heartbeats": self.__ticks,
+                            "suppressed_writes": self.__suppressedWrites,
+                            "sections": summary,
+                        },
+                        f,
+                        indent=2,
+                    )
+            except OSError as e:
+                Domoticz.Error("Unable to write statistics: {}".format(e))
+
+    def __saveState(self):
+        """
+        Write the cached events and the last written device values to the
+        state file in the plugin folder, for a warm start.
+        """
+        locations = {}
+        for loc in self.__locations:
+            locations[(loc.lat, loc.lon)] = {
+                "lat": loc.lat,
+                "lon": loc.lon,
+                "days": {},
+                "transit": None,
+                "moon": {},
+            }
+        state = {
+            "version": self.__STATE_VERSION,
+            "locations": list(locations.values()),
+            "lunation": {
+                phase: [float(previous), float(upcoming)]
+                for phase, (previous, upcoming) in self.__lunationCache.items()
+            },
+            "seasons": {
+                name: [
+                    float(since),
+                    float(until),
+                    [None if v is None else float(v) for v in value],
+                ]
+                for name, (since, until, value) in self.__seasonCache.items()
+            },
+            "shadow": {
+                Unit: [value, written.isoformat()]
+                for Unit, (value, written) in self.__shadow.items()
+            },
+        }
+        for key, events in self.__dailyEvents.items():
+            if key[1:3] not in locations:
+                continue
+            record = locations[key[1:3]]
+            if key[3] == "transit":
+                record["transit"] = float(events)
+            else:
+                day = record["days"].setdefault(key[0].isoformat(), {})
+                day[key[3][1]] = self.__packSunEvents(events)
+        for (lat, lon, field), event in self.__moonEvents.items():
+            if (lat, lon) in locations and event is not None:
+                locations[(lat, lon)]["moon"][field] = float(event)
+        try:
+            with open(
+                os.path.join(Parameters["HomeFolder"], self.__STATE_FILE), "w"
+            ) as f:
+                json.dump(state, f)
+        except OSError as e:
+            Domoticz.Error("Unable to write state: {}".format(e))
+
+    def __loadState(self):
+        """
+        Restore the state written by a previous run. The events of a
+        location are only used when it is still one of the locations, and
+        the sunrise, sunset and twilights only for the current local date
+        and the days before and after it.
+        All events are searched again anyway after they have passed.
+        """
+        path = os.path.join(Parameters["HomeFolder"], self.__STATE_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            if state.get("version") != self.__STATE_VERSION:
+                Domoticz.Log("State {} has another version, ignored".format(path))
+                return
+            self.__lunationCache = {
+                int(phase): (ephem.Date(previous), ephem.Date(upcoming))
+                for phase, (previous, upcoming) in state["lunation"].items()
+            }
+            self.__seasonCache = {
+                name: (ephem.Date(since), ephem.Date(until), value)
+                for name, (since, until, value) in state["seasons"].items()
+            }
+            self.__shadow = {
+                int(Unit): (value, datetime.datetime.fromisoformat(written))
+                for Unit, (value, written) in state["shadow"].items()
+            }
+            today = ephem.localtime(ephem.Date(UtcNow())).date()
+            current = {(loc.lat, loc.lon) for loc in self.__locations}
+            for record in state["locations"]:
+                lat, lon = record["lat"], record["lon"]
+                if (lat, lon) not in current:
+                    Domoticz.Log(
+                        "State {} of location {};{} not used".format(path, lat, lon)
+                    )
+                    continue
+                for date, day in record["days"].items():
+                    date = datetime.date.fromisoformat(date)
+                    if abs((date - today).days) > 1:
+                        continue
+                    for i, value in day.items():
+                        key = (date, lat, lon, ("twilight", int(i)))
+                        self.__dailyEvents[key] = self.__unpackSunEvents(value)
+                if record["transit"] is not None:
+                    key = (None, lat, lon, "transit")
+                    self.__dailyEvents[key] = ephem.Date(record["transit"])
+                for field, event in record["moon"].items():
+                    self.__moonEvents[(lat, lon, field)] = ephem.Date(event)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            Domoticz.Error("Unable to read state: {}".format(e))
+
+    def __nextPositionUpdate(self, name, position, loc, utc_now):
+        """
+        Time of the next position update of a body at a location, with
+        position(loc, utc_now) its position. Without a position step this is
+        the update interval. With a position step, the interval is chosen such
+        that neither altitude nor azimuth changes more than the step, based on
+        their current rate of change, between the heartbeat and a maximum
+        interval of its own. The update interval is then not used.
+        """
+        if not self.__step or self.__step <= 0:
+            return utc_now + self.__interval
+        alt, az = position(loc, utc_now)[:2]
+        next_alt, next_az = position(loc, utc_now + self.__RATE_PROBE)[:2]
+        d_alt = abs(deg(next_alt - alt))
+        d_az = abs((deg(next_az - az) + 180) % 360 - 180)
+        rate = max(d_alt, d_az) / self.__RATE_PROBE.total_seconds()
+        if rate > 0:
+            interval = datetime.timedelta(seconds=self.__step / rate)
+        else:
+            interval = self.__STEP_MAX_INTERVAL
+        interval = min(
+            max(interval, self.__STEP_MIN_INTERVAL), self.__STEP_MAX_INTERVAL
+        )
+        Domoticz.Debug(
+            "Position {} {}: {:.5f}°/s, next update in {}".format(
+                loc.name, name, rate, interval
+            )
+        )
+        return utc_now + interval
+
+    ################################################################################
+    # Jobs
+    #
+    # Every job updates a group of devices and returns the UTC time at which it
+    # has to run again. A job updates the devices of the location it is given,
+    # a shared job (without location) those of all locations.
+    ################################################################################
+    def __jobSunPosition(self, utc_now, loc):
+        alt, az, distance = self.__sunPosition(loc, utc_now)
+        #
+        # -------------------------------------------------------------------------------
+        # Sun altitude
+        # -------------------------------------------------------------------------------
+        value = round(deg(alt), 2)
+        self.__updateDevice(loc.offset + unit.SUN_ALT, int(value), str(value))
+        #
+        # -------------------------------------------------------------------------------
+        # Sun azimuth
+        # -------------------------------------------------------------------------------
+        value = round(deg(az), 2)
+        self.__updateDevice(loc.offset + unit.SUN_AZ, int(value), str(value))
+        #
+        # -------------------------------------------------------------------------------
+        # Sun distance
+        # -------------------------------------------------------------------------------
+        value = round(distance * ephem.meters_per_au / 1000)
+        self.__updateDevice(loc.offset + unit.SUN_DIST, int(value), str(value))
+        return self.__nextPositionUpdate("Sun", self.__sunPosition, loc, utc_now)
+
+    def __jobSunEvents(self, utc_now, loc):
+        target_date = ephem.localtime(ephem.Date(utc_now)).date()
+        next_due = NextLocalMidnight(utc_now)
+        #
+        # -------------------------------------------------------------------------------
+        # Sun transit
+        # -------------------------------------------------------------------------------
+        if self.__wanted(loc.offset + unit.SUN_TRANSIT):
+            transit = self.__sunTransit(loc, utc_now)
+            value = ephem.localtime(transit) + self.__SEC30
+            self.__updateDevice(
+                loc.offset + unit.SUN_TRANSIT,
+                0,
+                "{}".format(value.strftime(self.__DT_FORMAT)),
+            )
+            next_due = min(transit.datetime(), next_due)
+        #
+        # -------------------------------------------------------------------------------
+        # Sun rise & set today
+        # -------------------------------------------------------------------------------
+        indices = [
+            i
+            for i in range(len(self.__TWILIGHTS))
+            if self.__wanted(
+                loc.offset + unit.SUN_RISE + i, loc.offset + unit.SUN_SET + i
+            )
+            or (
+                i == 0
+                and self.__wanted(
+                    loc.offset + unit.DAY_LENGTH_M, loc.offset + unit.DAY_LENGTH_T
+                )
+            )
+        ]
+        day = self.__sunDay(loc, target_date, indices)
+        for i in indices:
+            rising, setting, state = day[i]
+            # Without a crossing the state is shown until the Sun crosses again
+            description = self.__CROSSING_DESCRIPTIONS.get(state, "No time available")
+            if rising is not None:
+                next_rising = ephem.localtime(rising) + self.__SEC30
+                self.__updateDevice(
+                    loc.offset + unit.SUN_RISE + i,
+                    0,
+                    "{}".format(next_rising.strftime(self.__DT_FORMAT)),
+                )
+            else:
+                self.__updateDevice(loc.offset + unit.SUN_RISE + i, 0, description)
+            if setting is not None:
+                next_setting = ephem.localtime(setting) + self.__SEC30
+                self.__updateDevice(
+                    loc.offset + unit.SUN_SET + i,
+                    0,
+                    "{}".format(next_setting.strftime(self.__DT_FORMAT)),
+                )
+            else:
+                self.__updateDevice(loc.offset + unit.SUN_SET + i, 0, description)
+            if i == 0:
+                if rising is not None and setting is not None:
+                    # From the minutes shown, so the same with an event table
+                    value = (
+                        next_setting.replace(second=0, microsecond=0)
+                        - next_rising.replace(second=0, microsecond=0)
+                    ).total_seconds()
+                elif rising is None and setting is None:
+                    value = 86400 if state == crossing.NEVER_SETS else 0
+                else:
+                    # Polar day or night starts or ends today
+                    continue
+                hh = divmod(value, 3600)
+                mm = divmod(hh[1], 60)
+                minutes = int(divmod(value, 60)[0])
+                self.__updateDevice(
+                    loc.offset + unit.DAY_LENGTH_M,
+                    minutes,
+                    "{}".format(minutes),
+                )
+                self.__updateDevice(
+                    loc.offset + unit.DAY_LENGTH_T,
+                    0,
+                    "{:02}:{:02}".format(int(hh[0]), int(mm[0])),
+                )
+        return next_due
+
+    def __jobMoonEvents(self, utc_now, loc):
+        #
+        # -------------------------------------------------------------------------------
+        # Moon rise & set
+        # -------------------------------------------------------------------------------
+        events = []
+        for Unit, field in (
+            (loc.offset + unit.MOON_RISE, "MOON_RISE"),
+            (loc.offset + unit.MOON_SET, "MOON_SET"),
+        ):
+            if not self.__wanted(Unit):
+                continue
+            event = self.__moonEvent(loc, utc_now, field)
+            if event is not None:
+                value = ephem.localtime(event) + self.__SEC30
+                self.__updateDevice(
+                    Unit, 0, "{}".format(value.strftime(self.__DT_FORMAT))
+                )
+                events.append(event)
+            else:
+                self.__updateDevice(Unit, 0, "{}".format("No time available"))
+        if not events:
+            return utc_now + datetime.timedelta(days=1)
+        return min(events).datetime()
+
+    def __jobMoonPosition(self, utc_now, loc):
+        alt, az, distance, phase = self.__moonPosition(loc, utc_now)
+        #
+        # -------------------------------------------------------------------------------
+        # Moon altitude
+        # -------------------------------------------------------------------------------
+        value = round(deg(alt), 2)
+        self.__updateDevice(loc.offset + unit.MOON_ALT, int(value), str(value))
+        #
+        # -------------------------------------------------------------------------------
+        # Moon azimuth
+        # -------------------------------------------------------------------------------
+        value = round(deg(az), 2)
+        self.__updateDevice(loc.offset + unit.MOON_AZ, int(value), str(value))
+        #
+        # -------------------------------------------------------------------------------
+        # Moon distance
+        # -------------------------------------------------------------------------------
+        value = round(distance * ephem.meters_per_au / 1000)
+        self.__updateDevice(loc.offset + unit.MOON_DIST, int(value), str(value))
+        #
+        # -------------------------------------------------------------------------------
+        # Moon illumination
+        # -------------------------------------------------------------------------------
+        value = round(deg(phase), 2)
+        self.__updateDevice(loc.offset + unit.MOON_ILLUMINATION, int(value), str(value))
+        return self.__nextPositionUpdate("Moon", self.__moonPosition, loc, utc_now)
+
+    def __jobLunation(self, utc_now):
+        #
+        # -------------------------------------------------------------------------------
+        # Next new moon, first quarter, full moon and last quarter
+        # -------------------------------------------------------------------------------
+        lunation = self.__lunation(utc_now)
+        for phase, Unit in [
+            (0, unit.MOON_NEXT_NEW),
+            (2, unit.MOON_NEXT_FIRST_QUARTER),
+            (4, unit.MOON_NEXT_FULL),
+            (6, unit.MOON_NEXT_LAST_QUARTER),
+        ]:
+            value = ephem.localtime(lunation[phase][1]) + self.__SEC30
+            for loc in self.__locations:
+                self.__updateDevice(
+                    loc.offset + Unit,
+                    0,
+                    "{}".format(value.strftime(self.__DT_FORMAT)),
+                )
+        return min(events[1] for events in lunation.values()).datetime()
+
+    def __jobMoonPhase(self, utc_now):
+        target_date = ephem.localtime(ephem.Date(utc_now)).date()
+        lunation = self.__lunation(utc_now)
+        #
+        # -------------------------------------------------------------------------------
+        # Moon phase
+        # -------------------------------------------------------------------------------
+        self.__phase = self.__moonPhase(utc_now, target_date, lunation)
+        image = images.PREFIX_IMAGE + images.PREFIX_PHASE + str(self.__phase)
+        for loc in self.__locations:
+            self.__updateDevice(
+                loc.offset + unit.MOON_PHASE,
+                0,
+                self.__MOON_PHASE_DESCRIPTIONS[self.__phase],
+            )
+            self.__updateDeviceImage(loc.offset + unit.MOON_PHASE, image)
+            self.__updateDeviceImage(loc.offset + unit.MOON_ILLUMINATION, image)
+        # The phase changes at a principal phase or when the local date changes
+        return min(
+            min(events[1] for events in lunation.values()).datetime(),
+            NextLocalMidnight(utc_now),
+        )
+
+    def __jobIrradiance(self, utc_now, loc):
+        value, height, cosines = loc.irradiance.at(
+            utc_now, LocalMidnight(utc_now), NextLocalMidnight(utc_now)
+        )
+        #
+        # -------------------------------------------------------------------------------
+        # Clear sky irradiance
+        # -------------------------------------------------------------------------------
+        value = round(value)
+        self.__updateDevice(loc.offset + unit.IRRADIANCE, value, str(value))
+        #
+        # -------------------------------------------------------------------------------
+        # Incidence and sun on the facades
+        # -------------------------------------------------------------------------------
+        for k, cosine in enumerate(cosines):
+            offset = loc.offset + k * self.__FACADE_UNITS
+            value = round(deg(acos(min(max(cosine, -1), 1))), 2)
+            self.__updateDevice(offset + unit.FACADE_INCIDENCE, int(value), str(value))
+            on = height > 0 and cosine > 0
+            self.__updateDevice(
+                offset + unit.FACADE_SUN, int(on), "On" if on else "Off"
+            )
+        return utc_now + self.__interval
+
+    def __jobSeasons(self, utc_now):
+        now = ephem.Date(utc_now)
+        seasons = self.__seasons(utc_now)
+        for loc in self.__locations:
+            hemisphere = 0 if float(loc.lat) >= 0 else 1
+            #
+            # -------------------------------------------------------------------------------
+            # Equinox, solstice, perihelion and aphelion
+            # -------------------------------------------------------------------------------
+            for Unit, name in [
+                (unit.NEXT_EQUINOX, "equinox"),
+                (unit.NEXT_SOLSTICE, "solstice"),
+                (unit.NEXT_PERIHELION, "perihelion"),
+                (unit.NEXT_APHELION, "aphelion"),
+            ]:
+                event = ephem.Date(seasons[name][0])
+                value = (ephem.localtime(event) + self.__SEC30).strftime(
+                    self.__DT_FORMAT
+                )
+                month = event.tuple()[1]
+                if month in self.__SEASONS:
+                    # The equinoxes and solstices start a season
+                    value = "{} ({})".format(value, self.__SEASONS[month][hemisphere])
+                self.__updateDevice(loc.offset + Unit, 0, value)
+            #
+            # -------------------------------------------------------------------------------
+            # Supermoon
+            # -------------------------------------------------------------------------------
+            event, distance = seasons["supermoon"]
+            if event is not None:
+                value = "{} ({:.0f} km)".format(
+                    (ephem.localtime(ephem.Date(event)) + self.__SEC30).strftime(
+                        self.__DT_FORMAT
+                    ),
+                    distance,
+                )
+            else:
+                value = "No time available"
+            self.__updateDevice(loc.offset + unit.NEXT_SUPERMOON, 0, value)
+            #
+            # -------------------------------------------------------------------------------
+            # Eclipse season
+            # -------------------------------------------------------------------------------
+            start, end = seasons["eclipse_season"]
+            value = "{} - {}".format(
+                ephem.localtime(ephem.Date(start)).strftime(self.__D_FORMAT),
+                ephem.localtime(ephem.Date(end)).strftime(self.__D_FORMAT),
+            )
+            if start <= now:
+                value = "Now, {}".format(value)
+            self.__updateDevice(loc.offset + unit.ECLIPSE_SEASON, 0, value)
+        # Run again when an event passes, or the eclipse season starts or ends
+        events = [until for _, until, _ in self.__seasonCache.values()]
+        start = seasons["eclipse_season"][0]
+        if start > now:
+            events.append(start)
+        return ephem.Date(min(events)).datetime() + self.__SWITCH_DELAY
+
+    def __jobSunSwitches(self, utc_now, loc):
+        now = ephem.Date(utc_now)
+        target_date = ephem.localtime(now).date()
+        next_due = NextLocalMidnight(utc_now)
+        #
+        # -------------------------------------------------------------------------------
+        # Daylight, twilights and night
+        # -------------------------------------------------------------------------------
+        switches = [
+            switch
+            for switch in self.__DAY_SWITCHES
+            if self.__wanted(loc.offset + switch[0])
+        ]
+        indices = sorted(
+            {
+                i
+                for _, higher, lower in switches
+                for i in (higher, lower)
+                if i is not None
+            }
+        )
+        # The days around today hold the next rising and setting at every horizon
+        days = [
+            self.__sunDay(loc, target_date + datetime.timedelta(days=d), indices)
+            for d in (-1, 0, 1)
+        ]
+        above = {}
+        for i in indices:
+            rising, setting = (
+                min(
+                    (
+                        day[i][k]
+                        for day in days
+                        if day[i][k] is not None and day[i][k] > now
+                    ),
+                    default=None,
+                )
+                for k in (0, 1)
+            )
+            if rising is None and setting is None:
+                # Polar day or night, the Sun is above when it does not set
+                above[i] = days[-1][i][2] in (crossing.NEVER_SETS, crossing.NO_TWILIGHT)
+            else:
+                above[i] = rising is None or (setting is not None and setting < rising)
+                # The switches change at the next crossing
+                event = min(e for e in (rising, setting) if e is not None)
+                next_due = min(event.datetime() + self.__SWITCH_DELAY, next_due)
+        for Unit, higher, lower in switches:
+            on = (higher is None or above[higher]) and (
+                lower is None or not above[lower]
+            )
+            self.__updateDevice(loc.offset + Unit, int(on), "On" if on else "Off")
+        return next_due
+
+    def __jobMoonSwitch(self, utc_now, loc):
+        #
+        # -------------------------------------------------------------------------------
+        # Moon above horizon
+        # -------------------------------------------------------------------------------
+        rising = self.__moonEvent(loc, utc_now, "MOON_RISE")
+        setting = self.__moonEvent(loc, utc_now, "MOON_SET")
+        if rising is None and setting is None:
+            # Up or down for the whole search window
+            on = self.__moonPosition(loc, utc_now)[0] > 0
+            next_due = utc_now + datetime.timedelta(days=1)
+        else:
+            on = rising is None or (setting is not None and setting < rising)
+            event = min(e for e in (rising, setting) if e is not None)
+            next_due = event.datetime() + self.__SWITCH_DELAY
+        self.__updateDevice(loc.offset + unit.MOON_UP, int(on), "On" if on else "Off")
+        return next_due
+
+    __JOBS = {
+        "sun_position": __jobSunPosition,
+        "sun_events": __jobSunEvents,
+        "moon_position": __jobMoonPosition,
+        "moon_events": __jobMoonEvents,
+        "lunation": __jobLunation,
+        "moon_phase": __jobMoonPhase,
+        "sun_switches": __jobSunSwitches,
+        "moon_switch": __jobMoonSwitch,
+        "irradiance": __jobIrradiance,
+        "seasons": __jobSeasons,
+    }
+
     def onCommand(self, Unit, Command, Level, Hue):
         Domoticz.Debug("onCommand: {}, {}, {}, {}".format(Unit, Command, Level, Hue))
 
@@ -316,20 +2511,76 @@ class BasePlugin:
             Domoticz.Debugging(self.__DEBUG_ALL)
         else:
             Domoticz.Debugging(self.__DEBUG_NONE)
+        try:
+            minutes = float(Parameters["Mode1"])
+            if not isfinite(minutes):
+                raise ValueError
+        except ValueError:
+            # Empty for the default
+            if Parameters["Mode1"].strip():
+                Domoticz.Error(
+                    "Invalid update interval '{}', using {} min".format(
+                        Parameters["Mode1"], self.__MINUTES
+                    )
+                )
+            minutes = self.__MINUTES
+        self.__interval = datetime.timedelta(minutes=max(minutes, 1 / 6))
+        try:
+            self.__step = float(Parameters["Mode2"])
+            if not isfinite(self.__step):
+                raise ValueError
+        except ValueError:
+            # Empty for no position step
+            if Parameters["Mode2"].strip():
+                Domoticz.Error(
+                    "Invalid position step '{}', ignored".format(Parameters["Mode2"])
+                )
+            self.__step = None
+        if Parameters["Mode5"] in ("Log", "File"):
+            self.__timings = timings(self.__STATS_WINDOW)
+        if Parameters["Mode5"] == "File":
+            self.__statsFile = os.path.join(Parameters["HomeFolder"], self.__STATS_FILE)
+        for table in self.__eventTables.values():
+            if table is not None:
+                table.close()
+        self.__eventTables = {}
         #
-        # Get Domoticz location
+        # Get Domoticz location, and the other locations
         loc = Settings["Location"].split(";")
-        self.__lat = loc[0]
-        self.__lon = loc[1]
-        if self.__lat is None or self.__lon is None:
+        if len(loc) < 2 or not loc[0] or not loc[1]:
             Domoticz.Error("Unable to parse coordinates")
             return False
-        self.__observer = ephem.Observer()
-        self.__observer.lat = self.__lat
-        self.__observer.lon = self.__lon
-        self.__observer.date = datetime.datetime.utcnow()
-        self.__sun = ephem.Sun()
-        self.__moon = ephem.Moon()
+        self.__locations = [location("", loc[0], loc[1], 0)]
+        self.__locations += self.__parseLocations(Parameters["Address"])
+        self.__facades = self.__parseFacades(Parameters["Username"])
+        self.__units = self.__UNITS + self.__facadeUnits()
+        if Parameters["Mode3"] == "Deadband":
+            policies = [(policy[0], policy[1:]) for policy in self.__WRITE_POLICIES]
+            for k in range(len(self.__facades)):
+                policies.append(
+                    (
+                        unit.FACADE_INCIDENCE + k * self.__FACADE_UNITS,
+                        self.__FACADE_WRITE_POLICY,
+                    )
+                )
+            self.__writePolicies = {
+                loc.offset + Unit: policy
+                for loc in self.__locations
+                for Unit, policy in policies
+            }
+        self.__loadState()
+        # Port holds an integer in Domoticz, so it only tells whether to use
+        # the shared cache, always the same file in the plugin folder
+        if Parameters["Port"] == "1" and "sharedcache" in sys.modules:
+            path = os.path.join(Parameters["HomeFolder"], self.__SHARED_CACHE_FILE)
+            try:
+                self.__sharedCache = sharedcache.SharedCache(path)
+            except sharedcache.Error as e:
+                Domoticz.Error("Unable to open shared cache {}: {}".format(path, e))
+        if Parameters["Mode4"] == "Worker":
+            self.__startWorker()
+        else:
+            self.__createEphem()
         #
         # Load images
         # Check if images are in database
@@ -338,23 +2589,63 @@ class BasePlugin:
                 zip = "{}.zip".format(image)
                 Domoticz.Image(zip).Create()
         #
-        # Create devices
-        for unit in self.__UNITS:
-            if unit[0] not in Devices:
-                Domoticz.Device(
-                    Unit=unit[0],
-                    Name=unit[1],
-                    Type=unit[2],
-                    Subtype=unit[3],
-                    Options=unit[4],
-                    Used=unit[5],
-                    Image=Images[unit[6]].ID,
-                ).Create()
+        # Create devices, per location in its own range of units and named
+        # after it. Devices which are missing later on, eg. deleted by the
+        # user or new in this version, are created as not used.
+        for loc in self.__locations:
+            first = not any(loc.offset + row[0] in Devices for row in self.__UNITS)
+            for row in self.__units:
+                if loc.offset + row[0] not in Devices:
+                    Domoticz.Device(
+                        Unit=loc.offset + row[0],
+                        Name="{} {}".format(loc.name, row[1]) if loc.name else row[1],
+                        Type=row[2],
+                        Subtype=row[3],
+                        Options=row[4],
+                        Used=row[5] if first else used.NO,
+                        Image=Images[row[6]].ID,
+                    ).Create()
         # Log config
-        DumpAllToLog()
+        if Parameters["Mode6"] == "Debug":
+            DumpAllToLog()
+        #
+        # Schedule all jobs to run at the first heartbeat, the shared jobs once
+        # and the other jobs per location
+        utc_now = UtcNow()
+        self.__schedule = []
+        self.__jobUnits = {}
+        for name in sorted(self.__JOBS):
+            units = [row[0] for row in self.__units if name in row[7]]
+            if name in self.__SHARED_JOBS:
+                jobs = [(None, self.__locations)]
+            else:
+                jobs = [(index, [loc]) for index, loc in enumerate(self.__locations)]
+            for index, locations in jobs:
+                self.__jobUnits[(name, index)] = [
+                    loc.offset + Unit for loc in locations for Unit in units
+                ]
+                self.__schedule.append((utc_now, name, index))
+        heapq.heapify(self.__schedule)
 
     def onStop(self):
         Domoticz.Debug("onStop")
+        stopped = True
+        if self.__worker is not None:
+            # Make room for the stop, the waiting ticks are of no interest
+            while not self.__tasks.empty():
+                self.__tasks.get()
+            self.__tasks.put(None)
+            self.__worker.join(self.__WORKER_STOP_TIMEOUT)
+            if self.__worker.is_alive():
+                # It still changes the state, which is then not saved
+                Domoticz.Error("Worker thread did not stop, state not saved")
+                stopped = False
+            self.__worker = None
+        if self.__locations and stopped:
+            self.__saveState()
+        if self.__sharedCache is not None:
+            self.__sharedCache.close()
+            self.__sharedCache = None
 
     def onMessage(self, Connection, Data):
         Domoticz.Debug("onMessage: {}, {}".format(Connection.Name, Data))
@@ -371,295 +2662,46 @@ class BasePlugin:
 
     def onHeartbeat(self):
         Domoticz.Debug("onHeartbeat")
-        self.__runAgain -= 1
-        if self.__runAgain <= 0:
-            self.__runAgain = self.__HEARTBEATS2MIN * self.__MINUTES
-            #
-            utc_now = datetime.datetime.utcnow()
-            target_date = datetime.datetime.now().date()
-            #
-            self.__observer.date = utc_now
-            self.__sun.compute(self.__observer)
-            #
-            ################################################################################
-            # Sun data
-            ################################################################################
-            #
-            # -------------------------------------------------------------------------------
-            # Sun altitude
-            # -------------------------------------------------------------------------------
-            value = round(deg(self.__sun.alt), 2)
-            UpdateDevice(unit.SUN_ALT, int(value), str(value))
-            #
-            # -------------------------------------------------------------------------------
-            # Sun azimuth
-            # -------------------------------------------------------------------------------
-            value = round(deg(self.__sun.az), 2)
-            UpdateDevice(unit.SUN_AZ, int(value), str(value))
-            #
-            # -------------------------------------------------------------------------------
-            # Sun distance
-            # -------------------------------------------------------------------------------
-            value = round(self.__sun.earth_distance * ephem.meters_per_au / 1000)
-            UpdateDevice(unit.SUN_DIST, int(value), str(value))
-            #
-            # -------------------------------------------------------------------------------
-            # Sun transit
-            # -------------------------------------------------------------------------------
-            value = (
-                ephem.localtime(self.__observer.next_transit(self.__sun)) + self.__SEC30
-            )
-            UpdateDevice(
-                unit.SUN_TRANSIT, 0, "{}".format(value.strftime(self.__DT_FORMAT))
+        heartbeat = time.perf_counter()
+        utc_now = UtcNow()
+        if self.__worker is not None or (
+            self.__schedule and self.__schedule[0][0] <= utc_now
+        ):
+            self.__present = frozenset(
+                Unit for Unit, Device in Devices.items() if Device.Used
             )
-            #
-            # -------------------------------------------------------------------------------
-            # Sun rise & set today
-            # -------------------------------------------------------------------------------
-            self.__observer.date = target_date
-            self.__sun.compute(self.__observer)
-            i = 0
-            for t in self.__TWILIGHTS:
-                # Zero the horizon
-                self.__observer.horizon = t[0]
-                try:
-                    next_rising = (
-                        ephem.localtime(
-                            self.__observer.next_rising(self.__sun, use_center=t[1])
-                        )
-                        + self.__SEC30
-                    )
-                    UpdateDevice(
-                        unit.SUN_RISE + i,
-                        0,
-                        "{}".format(next_rising.strftime(self.__DT_FORMAT)),
-                    )
-                except:
-                    UpdateDevice(
-                        unit.SUN_RISE + i,
-                        0,
-                        "{}".format("No time available"),
-                    )
+        # All device updates are written at the end, once per device
+        BeginDeviceUpdates()
+        try:
+            if self.__worker is None:
+                for job in self.__runJobs(utc_now):
+                    self.__timings.add(*job)
+            else:
+                # Apply the results of the worker and hand it the next tick
+                self.__applyResults()
+                if not self.__worker.is_alive():
+                    if utc_now - self.__workerStarted >= self.__WORKER_RESTART:
+                        Domoticz.Error("Worker thread not running, restarting it")
+                        self.__startWorker()
                 try:
-                    next_setting = (
-                        ephem.localtime(
-                            self.__observer.next_setting(self.__sun, use_center=t[1])
-                        )
-                        + self.__SEC30
-                    )
-                    UpdateDevice(
-                        unit.SUN_SET + i,
-                        0,
-                        "{}".format(next_setting.strftime(self.__DT_FORMAT)),
+                    self.__tasks.put_nowait(utc_now)
+                except queue.Full:
+                    Domoticz.Debug(
+                        "Worker thread busy, tick {} skipped".format(utc_now)
                     )
-                except:
-                    UpdateDevice(
-                        unit.SUN_RISE + i,
-                        0,
-                        "{}".format("No time available"),
-                    )
-                if i == 0:
-                    value = (next_setting - next_rising).total_seconds()
-                    hh = divmod(value, 3600)
-                    mm = divmod(hh[1], 60)
-                    min = int(divmod(value, 60)[0])
-                    UpdateDevice(
-                        unit.DAY_LENGTH_M,
-                        min,
-                        "{}".format(min),
-                    )
-                    UpdateDevice(
-                        unit.DAY_LENGTH_T,
-                        0,
-                        "{:02}:{:02}".format(int(hh[0]), int(mm[0])),
-                    )
-
-                i += 1
-            #
-            # Reset horizon for further calculations
-            self.__observer.horizon = "0"
-            #
-            ################################################################################
-            # Moon data
-            ################################################################################
-            #
-            self.__observer.date = utc_now
-            self.__moon.compute(self.__observer)
-            #
-            # -------------------------------------------------------------------------------
-            # Moon rise
-            # -------------------------------------------------------------------------------
-            value = (
-                ephem.localtime(self.__observer.next_rising(self.__moon)) + self.__SEC30
-            )
-            UpdateDevice(
-                unit.MOON_RISE, 0, "{}".format(value.strftime(self.__DT_FORMAT))
-            )
-            #
-            # -------------------------------------------------------------------------------
-            # Moon set
-            # -------------------------------------------------------------------------------
-            value = (
-                ephem.localtime(self.__observer.next_setting(self.__moon))
-                + self.__SEC30
-            )
-            UpdateDevice(
-                unit.MOON_SET, 0, "{}".format(value.strftime(self.__DT_FORMAT))
-            )
-            #
-            # -------------------------------------------------------------------------------
-            # Moon altitude
-            # -------------------------------------------------------------------------------
-            self.__moon.compute(self.__observer)
-            #
-            value = round(deg(self.__moon.alt), 2)
-            UpdateDevice(unit.MOON_ALT, int(value), str(value))
-            #
-            # -------------------------------------------------------------------------------
-            # Moon azimuth
-            # -------------------------------------------------------------------------------
-            value = round(deg(self.__moon.az), 2)
-            UpdateDevice(unit.MOON_AZ, int(value), str(value))
-            #
-            # -------------------------------------------------------------------------------
-            # Moon distance
-            # -------------------------------------------------------------------------------
-            value = round(self.__moon.earth_distance * ephem.meters_per_au / 1000)
-            UpdateDevice(unit.MOON_DIST, int(value), str(value))
-            #
-            # -------------------------------------------------------------------------------
-            # Next new moon
-            # -------------------------------------------------------------------------------
-            next_new = ephem.localtime(ephem.next_new_moon(utc_now))
-            value = next_new + self.__SEC30
-            UpdateDevice(
-                unit.MOON_NEXT_NEW, 0, "{}".format(value.strftime(self.__DT_FORMAT))
-            )
-            #
-            # -------------------------------------------------------------------------------
-            # Next first quarter
-            # -------------------------------------------------------------------------------
-            next_first_quarter = ephem.localtime(ephem.next_first_quarter_moon(utc_now))
-            value = next_first_quarter + self.__SEC30
-            UpdateDevice(
-                unit.MOON_NEXT_FIRST_QUARTER,
-                0,
-                "{}".format(value.strftime(self.__DT_FORMAT)),
-            )
-            #
-            # -------------------------------------------------------------------------------
-            # Next full moon
-            # -------------------------------------------------------------------------------
-            next_full = ephem.localtime(ephem.next_full_moon(utc_now))
-            value = next_full + self.__SEC30
-            UpdateDevice(
-                unit.MOON_NEXT_FULL,
-                0,
-                "{}".format(value.strftime(self.__DT_FORMAT)),
-            )
-            #
-            # -------------------------------------------------------------------------------
-            # Next last quarter
-            # -------------------------------------------------------------------------------
-            next_last_quarter = ephem.localtime(ephem.next_last_quarter_moon(utc_now))
-            value = next_last_quarter + self.__SEC30
-            UpdateDevice(
-                unit.MOON_NEXT_LAST_QUARTER,
-                0,
-                "{}".format(value.strftime(self.__DT_FORMAT)),
-            )
-            #
-            # -------------------------------------------------------------------------------
-            # Moon phase
-            # -------------------------------------------------------------------------------
-            next_full = next_full.date()
-            next_new = next_new.date()
-            next_last_quarter = next_last_quarter.date()
-            next_first_quarter = next_first_quarter.date()
-            previous_full = ephem.localtime(ephem.previous_full_moon(utc_now)).date()
-            previous_new = ephem.localtime(ephem.previous_new_moon(utc_now)).date()
-            previous_last_quarter = ephem.localtime(
-                ephem.previous_last_quarter_moon(utc_now)
-            ).date()
-            previous_first_quarter = ephem.localtime(
-                ephem.previous_first_quarter_moon(utc_now)
-            ).date()
-            #
-            # Domoticz.Debug("target_date: {}".format(target_date))
-            # Domoticz.Debug("next_full: {}".format(next_full))
-            # Domoticz.Debug("next_new: {}".format(next_new))
-            # Domoticz.Debug("next_last_quarter: {}".format(next_last_quarter))
-            # Domoticz.Debug("next_first_quarter: {}".format(next_first_quarter))
-            # Domoticz.Debug("previous_full: {}".format(previous_full))
-            # Domoticz.Debug("previous_new: {}".format(previous_new))
-            # Domoticz.Debug("previous_last_quarter: {}".format(previous_last_quarter))
-            # Domoticz.Debug("previous_first_quarter: {}".format(previous_first_quarter))
-
-            if target_date in (next_new, previous_new):
-                phase = 0
-            elif target_date in (next_first_quarter, previous_first_quarter):
-                phase = 2
-            elif target_date in (next_full, previous_full):
-                phase = 4
-            elif target_date in (next_last_quarter, previous_last_quarter):
-                phase = 6
-            elif (
-                previous_new
-                < next_first_quarter
-                < next_full
-                < next_last_quarter
-                < next_new
-            ):
-                phase = 1
-            elif (
-                previous_first_quarter
-                < next_full
-                < next_last_quarter
-                < next_new
-                < next_first_quarter
-            ):
-                phase = 3
-            elif (
-                previous_full
-                < next_last_quarter
-                < next_new
-                < next_first_quarter
-                < next_full
-            ):
-                phase = 5
-            elif (
-                previous_last_quarter
-                < next_new
-                < next_first_quarter
-                < next_full
-                < next_last_quarter
-            ):
-                phase = 7
+        finally:
+            if self.__timings is None:
+                EndDeviceUpdates()
             else:
-                phase = 4
-            UpdateDevice(unit.MOON_PHASE, 0, self.__MOON_PHASE_DESCRIPTIONS[phase])
-            UpdateDeviceImage(
-                unit.MOON_PHASE, images.PREFIX_IMAGE + images.PREFIX_PHASE + str(phase)
-            )
-            #
-            self.__moon.compute(self.__observer)
-            #
-            # -------------------------------------------------------------------------------
-            # Moon illumination
-            # -------------------------------------------------------------------------------
-            value = round(deg(self.__moon.moon_phase), 2)
-            UpdateDevice(unit.MOON_ILLUMINATION, int(value), str(value))
-            UpdateDeviceImage(
-                unit.MOON_ILLUMINATION,
-                images.PREFIX_IMAGE + images.PREFIX_PHASE + str(phase),
-            )
-            #
-        else:
-            Domoticz.Debug(
-                "onHeartbeat called, run again in {} heartbeats.".format(
-                    self.__runAgain
+                started = time.perf_counter()
+                writes = EndDeviceUpdates()
+                self.__timings.add("device_writes", time.perf_counter() - started)
+                self.__timings.add(
+                    "heartbeat", time.perf_counter() - heartbeat, writes=writes
                 )
-            )
+                self.__ticks += 1
+                if self.__ticks % self.__STATS_HEARTBEATS == 0:
+                    self.__reportStatistics()
 
 
 global _plugin
@@ -784,26 +2826,95 @@ def DumpHTTPResponseToLog(httpDict):
                 Domoticz.Debug("....'" + x + "':'" + str(httpDict[x]) + "'")
 
 
+# Clock of the plugin, a function returning the current UTC time
+_clock = datetime.datetime.utcnow
+
+
+def SetClock(clock):
+    # Replace the clock, eg. by a virtual clock for a simulation
+    global _clock
+    _clock = clock
+
+
+def UtcNow():
+    # Current UTC time, all times of the plugin come from here
+    return _clock()
+
+
+def LocalMidnight(utc_now, days=0):
+    # Start of the local day, or of a number of days later, in UTC
+    local_date = ephem.localtime(ephem.Date(utc_now)).date()
+    midnight = datetime.datetime.combine(
+        local_date + datetime.timedelta(days=days), datetime.time()
+    )
+    return midnight.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def NextLocalMidnight(utc_now):
+    # Start of the next local day, in UTC
+    return LocalMidnight(utc_now, 1)
+
+
+# Pending device updates per unit, only while device updates are batched
+_pendingUpdates = None
+
+
+def BeginDeviceUpdates():
+    # Collect all device updates until EndDeviceUpdates
+    global _pendingUpdates
+    _pendingUpdates = {}
+
+
+def EndDeviceUpdates():
+    # Write every device with pending updates once. Returns number of writes.
+    global _pendingUpdates
+    pending = _pendingUpdates or {}
+    _pendingUpdates = None
+    for Unit in pending:
+        Devices[Unit].Update(**pending[Unit])
+    return len(pending)
+
+
+def DeviceValue(Unit, Field):
+    # Value of a device field, including pending updates
+    if _pendingUpdates is not None and Field in _pendingUpdates.get(Unit, {}):
+        return _pendingUpdates[Unit][Field]
+    return getattr(Devices[Unit], Field)
+
+
+def QueueDeviceUpdate(Unit, **kwargs):
+    # Update the device directly, or merge into its pending update
+    if _pendingUpdates is None:
+        update = {"nValue": Devices[Unit].nValue, "sValue": Devices[Unit].sValue}
+        update.update(kwargs)
+        Devices[Unit].Update(**update)
+    else:
+        update = _pendingUpdates.setdefault(
+            Unit, {"nValue": Devices[Unit].nValue, "sValue": Devices[Unit].sValue}
+        )
+        update.update(kwargs)
+
+
 def UpdateDevice(Unit, nValue, sValue, TimedOut=0, AlwaysUpdate=False):
     if Unit in Devices:
         if (
-            Devices[Unit].nValue != nValue
-            or Devices[Unit].sValue != sValue
-            or Devices[Unit].TimedOut != TimedOut
+            DeviceValue(Unit, "nValue") != nValue
+            or DeviceValue(Unit, "sValue") != sValue
+            or DeviceValue(Unit, "TimedOut") != TimedOut
             or AlwaysUpdate
         ):
-            Devices[Unit].Update(nValue=nValue, sValue=str(sValue), TimedOut=TimedOut)
+            QueueDeviceUpdate(
+                Unit, nValue=nValue, sValue=str(sValue), TimedOut=TimedOut
+            )
             # Domoticz.Debug("Update {}: {} - '{}'".format(Devices[Unit].Name, nValue, sValue))
+            return True
+    return False
 
 
 def UpdateDeviceOptions(Unit, Options={}):
     if Unit in Devices:
-        if Devices[Unit].Options != Options:
-            Devices[Unit].Update(
-                nValue=Devices[Unit].nValue,
-                sValue=Devices[Unit].sValue,
-                Options=Options,
-            )
+        if DeviceValue(Unit, "Options") != Options:
+            QueueDeviceUpdate(Unit, Options=Options)
             Domoticz.Debug(
                 "Device Options update: {} = {}".format(Devices[Unit].Name, Options)
             )
@@ -811,12 +2922,8 @@ def UpdateDeviceOptions(Unit, Options={}):
 
 def UpdateDeviceImage(Unit, Image):
     if Unit in Devices and Image in Images:
-        if Devices[Unit].Image != Images[Image].ID:
-            Devices[Unit].Update(
-                nValue=Devices[Unit].nValue,
-                sValue=Devices[Unit].sValue,
-                Image=Images[Image].ID,
-            )
+        if DeviceValue(Unit, "Image") != Images[Image].ID:
+            QueueDeviceUpdate(Unit, Image=Images[Image].ID)
             Domoticz.Debug(
                 "Device Image update: {} = {}".format(
                     Devices[Unit].Name, Images[Image].ID
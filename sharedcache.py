@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""
+Cache of computed sun and moon events, shared by plugin instances.
+
+Several SunMoon hardware instances, or several Domoticz installs on one
+host, can point to the same cache file. An instance reads an entry before
+computing it, and publishes what it has computed. The file is an SQLite
+database, so concurrent instances are serialized by its file locking.
+
+An entry is keyed by (quantity, date, lat, lon, horizon), with latitude and
+longitude rounded to PRECISION decimals (about 100 m), so nearby locations
+share entries. Events which do not depend on the location or date, like
+the lunar quarters, have None for those. Values are anything JSON can
+hold. The cache holds at most a number of entries; the least recently used
+entries are evicted first. Reading takes no write lock: the use of the
+entries read is recorded with the next write, or when the cache is closed.
+Show or clear the entries of a cache with:
+
+    python3 sharedcache.py sunmoon_cache.sqlite --clear
+"""
+import argparse
+import json
+import sqlite3
+import time
+
+# Raised when the cache file cannot be used
+Error = sqlite3.Error
+
+VERSION = 2
+# Decimals of the rounded latitude and longitude of the key
+PRECISION = 3
+MAX_ENTRIES = 10000
+# Seconds to wait for the lock of another instance
+TIMEOUT = 5.0
+
+
+class SharedCache:
+    """
+    Shared cache file. get() and put() raise Error when the file cannot be
+    used, eg. when it stays locked longer than the timeout.
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES, timeout=TIMEOUT):
+        self.path = path
+        self.max_entries = max_entries
+        # Used from the plugin thread or the worker thread, never at once
+        self.__db = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        # Keys of the entries read since the last write, with their time
+        self.__used = {}
+        self.__write(self.__create)
+
+    def __create(self, db):
+        if db.execute("PRAGMA user_version").fetchone()[0] != VERSION:
+            db.execute("DROP TABLE IF EXISTS cache")
+            db.execute("PRAGMA user_version = {}".format(VERSION))
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "quantity TEXT, date TEXT, lat TEXT, lon TEXT, horizon TEXT, "
+            "value TEXT, used REAL, "
+            "PRIMARY KEY (quantity, date, lat, lon, horizon))"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+
+    def __write(self, change):
+        # One write transaction, holding the lock of the file, which also
+        # records the use of the entries read since the last one
+        self.__db.execute("BEGIN IMMEDIATE")
+        try:
+            if self.__used:
+                self.__db.executemany(
+                    "UPDATE cache SET used = ? WHERE quantity = ? AND date = ? "
+                    "AND lat = ? AND lon = ? AND horizon = ?",
+                    [(used,) + key for key, used in self.__used.items()],
+                )
+            result = change(self.__db)
+        except:
+            self.__db.execute("ROLLBACK")
+            raise
+        self.__db.execute("COMMIT")
+        self.__used.clear()
+        return result
+
+    def __key(self, quantity, date, lat, lon, horizon):
+        # None is stored as "", NULL would make every key unique
+        return (
+            quantity,
+            "" if date is None else date.isoformat(),
+            "" if lat is None else "{:.{}f}".format(float(lat), PRECISION),
+            "" if lon is None else "{:.{}f}".format(float(lon), PRECISION),
+            "" if horizon is None else str(horizon),
+        )
+
+    def get(self, quantity, date=None, lat=None, lon=None, horizon=None):
+        """
+        Value of an entry, None when it is not in the cache.
+        """
+        key = self.__key(quantity, date, lat, lon, horizon)
+        row = self.__db.execute(
+            "SELECT value FROM cache WHERE quantity = ? AND date = ? AND lat = ? "
+            "AND lon = ? AND horizon = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        self.__used[key] = time.time()
+        return json.loads(row[0])
+
+    def put(self, quantity, date=None, lat=None, lon=None, horizon=None, value=None):
+        """
+        Publish an entry, replacing an entry with the same key. The least
+        recently used entries are evicted when the cache is full.
+        """
+        key = self.__key(quantity, date, lat, lon, horizon)
+
+        def change(db):
+            db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (json.dumps(value), time.time()),
+            )
+            excess = (
+                db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+                - self.max_entries
+            )
+            if excess > 0:
+                db.execute(
+                    "DELETE FROM cache WHERE rowid IN "
+                    "(SELECT rowid FROM cache ORDER BY used LIMIT ?)",
+                    (excess,),
+                )
+
+        self.__write(change)
+
+    def entries(self):
+        # Number of entries per quantity
+        return dict(
+            self.__db.execute(
+                "SELECT quantity, COUNT(*) FROM cache GROUP BY quantity"
+            ).fetchall()
+        )
+
+    def clear(self):
+        self.__write(lambda db: db.execute("DELETE FROM cache"))
+
+    def close(self):
+        try:
+            if self.__used:
+                self.__write(lambda db: None)
+        finally:
+            self.__db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Show or clear the entries of a shared cache"
+    )
+    parser.add_argument("path", help="cache file")
+    parser.add_argument("--clear", action="store_true", help="remove all entries")
+    args = parser.parse_args(argv)
+    cache = SharedCache(args.path)
+    if args.clear:
+        cache.clear()
+    for quantity, count in sorted(cache.entries().items()):
+        print("{}: {} entries".format(quantity, count))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
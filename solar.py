@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""
+Solar position backends.
+
+A backend computes the altitude, azimuth and distance of the Sun for many
+instants at once, and the times at which the Sun crosses a horizon:
+
+    position(lat, lon, timestamps) -> (altitudes, azimuths, distances)
+    crossings(lat, lon, starts, horizon, use_center) -> (risings, settings)
+
+Latitude, longitude, horizon, altitude and azimuth are in degrees, distances
+in km, and times in seconds since the Unix epoch (UTC). A crossing which is
+not found within two days after its start is NaN/None.
+
+EphemBackend is the reference, computing every instant with ephem.
+NumpyBackend computes all instants in one vectorized pass with the NOAA
+solar position algorithm (after Meeus), including parallax and the same
+atmospheric refraction as libastro, the library behind ephem.
+"""
+import datetime
+import importlib.util
+import math
+
+try:
+    import ephem
+except ImportError:
+    ephem = None
+
+# Imported by the first NumpyBackend, so only the users of that backend load
+# numpy, which does not support eg. the sub-interpreters of Domoticz plugins
+np = None
+
+AU = 149597870.7  # km
+# Sun radius at 1 AU, in degrees
+SUN_RADIUS = 959.63 / 3600
+# Atmosphere used by ephem by default
+PRESSURE = 1010.0  # mBar
+TEMPERATURE = 15.0  # Celsius
+# Crossings are searched up to this many seconds after their start
+SEARCH = 2 * 86400
+SEARCH_STEP = 600
+UNIX_EPOCH_JD = 2440587.5
+
+
+class EphemBackend:
+    """Reference backend, using ephem for every instant"""
+
+    name = "ephem"
+
+    def __init__(self):
+        self.__epoch = ephem.Date(datetime.datetime(1970, 1, 1))
+
+    def __observer(self, lat, lon):
+        observer = ephem.Observer()
+        observer.lat = str(lat)
+        observer.lon = str(lon)
+        return observer
+
+    def __date(self, timestamp):
+        return ephem.Date(self.__epoch + timestamp / 86400)
+
+    def __timestamp(self, date):
+        return (date - self.__epoch) * 86400
+
+    def position(self, lat, lon, timestamps):
+        observer = self.__observer(lat, lon)
+        sun = ephem.Sun()
+        altitudes = []
+        azimuths = []
+        distances = []
+        for timestamp in timestamps:
+            observer.date = self.__date(timestamp)
+            sun.compute(observer)
+            altitudes.append(math.degrees(sun.alt))
+            azimuths.append(math.degrees(sun.az))
+            distances.append(sun.earth_distance * ephem.meters_per_au / 1000)
+        return altitudes, azimuths, distances
+
+    def crossings(self, lat, lon, starts, horizon=0.0, use_center=False):
+        observer = self.__observer(lat, lon)
+        observer.horizon = str(horizon)
+        sun = ephem.Sun()
+        risings = []
+        settings = []
+        for start in starts:
+            for search, result in (
+                (observer.next_rising, risings),
+                (observer.next_setting, settings),
+            ):
+                observer.date = self.__date(start)
+                try:
+                    date = search(sun, use_center=use_center)
+                    result.append(self.__timestamp(date))
+                except (ephem.AlwaysUpError, ephem.NeverUpError):
+                    result.append(None)
+        return risings, settings
+
+
+class NumpyBackend:
+    """Vectorized backend, computing all instants in one pass"""
+
+    name = "numpy"
+
+    def __init__(self):
+        global np
+        import numpy as np
+
+    def __ecliptic(self, timestamps):
+        """
+        Apparent right ascension, declination, distance (AU), and Greenwich
+        apparent sidereal time, all in radians, for an array of timestamps.
+        """
+        jd = np.asarray(timestamps, dtype=float) / 86400 + UNIX_EPOCH_JD
+        t = (jd - 2451545.0) / 36525
+        l0 = np.radians((280.46646 + t * (36000.76983 + t * 0.0003032)) % 360)
+        m = np.radians(357.52911 + t * (35999.05029 - 0.0001537 * t))
+        e = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+        c = np.radians(
+            np.sin(m) * (1.914602 - t * (0.004817 + 0.000014 * t))
+            + np.sin(2 * m) * (0.019993 - 0.000101 * t)
+            + np.sin(3 * m) * 0.000289
+        )
+        true_longitude = l0 + c
+        distance = 1.000001018 * (1 - e * e) / (1 + e * np.cos(m + c))
+        omega = np.radians(125.04 - 1934.136 * t)
+        longitude = true_longitude - np.radians(0.00569 + 0.00478 * np.sin(omega))
+        obliquity = np.radians(
+            23
+            + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+            + 0.00256 * np.cos(omega)
+        )
+        ra = np.arctan2(np.cos(obliquity) * np.sin(longitude), np.cos(longitude))
+        dec = np.arcsin(np.sin(obliquity) * np.sin(longitude))
+        d = jd - 2451545.0
+        gmst = np.radians(
+            (
+                280.46061837
+                + 360.98564736629 * d
+                + t * t * (0.000387933 - t / 38710000)
+                # Equation of the equinoxes
+                - 0.00478 * np.sin(omega) * np.cos(obliquity)
+            )
+            % 360
+        )
+        return ra, dec, distance, gmst
+
+    def __altaz(self, lat, lon, timestamps):
+        ra, dec, distance, gmst = self.__ecliptic(timestamps)
+        phi = np.radians(lat)
+        h = gmst + np.radians(lon) - ra
+        sin_alt = np.sin(phi) * np.sin(dec) + np.cos(phi) * np.cos(dec) * np.cos(h)
+        alt = np.arcsin(np.clip(sin_alt, -1, 1))
+        az = np.arctan2(np.sin(h), np.cos(h) * np.sin(phi) - np.tan(dec) * np.cos(phi))
+        # Topocentric parallax
+        alt = alt - np.radians(8.794 / 3600) / distance * np.cos(alt)
+        return np.degrees(alt), (np.degrees(az) + 180) % 360, distance
+
+    def __unrefract(self, aa):
+        """
+        True altitude from the apparent altitude, both in degrees, with the
+        formulas of libastro (ephem): below 14.5 and above 15.5 degrees, and
+        blended in between.
+        """
+
+        def lt15(a):
+            r = ((2e-5 * a + 1.96e-2) * a + 1.594e-1) * PRESSURE
+            r = r / ((273 + TEMPERATURE) * ((8.45e-2 * a + 5.05e-1) * a + 1))
+            return np.where((a < 0) & (r < 0), a, a - r)
+
+        def ge15(a):
+            r = 7.888888e-5 * PRESSURE / ((273 + TEMPERATURE) * np.tan(np.radians(a)))
+            return a - np.degrees(r)
+
+        low = lt15(np.minimum(aa, 14.5))
+        high = ge15(np.maximum(aa, 15.5))
+        t_low = lt15(np.float64(14.5))
+        t_high = ge15(np.float64(15.5))
+        blend = t_low + (t_high - t_low) * (aa - 14.5)
+        return np.where(aa < 14.5, low, np.where(aa >= 15.5, high, blend))
+
+    def __refract(self, ta):
+        """
+        Apparent altitude from the true altitude, by inverting __unrefract
+        with the secant method, as libastro does.
+        """
+        t = self.__unrefract(ta)
+        d = 0.8 * (ta - t)
+        t0 = t
+        a = np.array(ta, dtype=float)
+        for _ in range(8):
+            a = a + d
+            t = self.__unrefract(a)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                d = np.where(t0 != t, d * -(ta - t) / (t0 - t), 0.0)
+            t0 = t
+        return a
+
+    def position(self, lat, lon, timestamps):
+        alt, az, distance = self.__altaz(lat, lon, timestamps)
+        return self.__refract(alt), az, distance * AU
+
+    def __elevation(self, lat, lon, timestamps, horizon, use_center):
+        # Apparent altitude of the limb or centre above the horizon
+        alt, az, distance = self.__altaz(lat, lon, timestamps)
+        alt = self.__refract(alt)
+        if not use_center:
+            alt = alt + SUN_RADIUS / distance
+        return alt - horizon
+
+    def crossings(self, lat, lon, starts, horizon=0.0, use_center=False):
+        starts = np.asarray(starts, dtype=float)
+        steps = np.arange(0, SEARCH + SEARCH_STEP, SEARCH_STEP, dtype=float)
+        times = starts[:, None] + steps[None, :]
+        f = self.__elevation(lat, lon, times, horizon, use_center)
+        results = []
+        for rising in (True, False):
+            if rising:
+                found = (f[:, :-1] < 0) & (f[:, 1:] >= 0)
+            else:
+                found = (f[:, :-1] >= 0) & (f[:, 1:] < 0)
+            has = found.any(axis=1)
+            index = found.argmax(axis=1)
+            rows = np.arange(len(starts))
+            a = times[rows, index]
+            b = times[rows, index + 1]
+            fa = f[rows, index]
+            # Bisection on all brackets at once, to well below a second
+            for _ in range(12):
+                middle = (a + b) / 2
+                fm = self.__elevation(lat, lon, middle, horizon, use_center)
+                left = (fm >= 0) == (fa >= 0)
+                a = np.where(left, middle, a)
+                fa = np.where(left, fm, fa)
+                b = np.where(left, b, middle)
+            results.append(np.where(has, (a + b) / 2, np.nan))
+        return results[0], results[1]
+
+
+def backend(name=None):
+    """
+    Backend by name ("ephem" or "numpy"). Without a name the numpy backend
+    when numpy is available, otherwise ephem.
+    """
+    if name is None:
+        name = "numpy" if importlib.util.find_spec("numpy") else "ephem"
+    if name == "numpy":
+        return NumpyBackend()
+    if name == "ephem":
+        if ephem is None:
+            raise ImportError("ephem not available")
+        return EphemBackend()
+    raise ValueError("Unknown solar backend: {}".format(name))
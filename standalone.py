@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""
+In-process stand-in for the Domoticz Python plugin framework.
+
+Provides the Domoticz module (Device, Image, Debug, Log, ...) and loads
+plugin.py with its own Devices, Images, Parameters and Settings, so the
+plugin can run without Domoticz, eg. for the export of its events, the
+benchmarks and the tests.
+"""
+import datetime
+import importlib.util
+import os
+import sys
+import types
+
+PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugin.py")
+
+
+class Image:
+    """Image, created from a zip file in the plugin folder"""
+
+    def __init__(self, Filename):
+        self.Filename = Filename
+        self.Name = os.path.splitext(Filename)[0]
+        self.ID = 0
+
+    def Create(self):
+        images = _current.Images
+        self.ID = len(images) + 1
+        images[self.Name] = self
+
+
+class Device:
+    """Device, counting its writes"""
+
+    def __init__(
+        self,
+        Name="",
+        Unit=0,
+        Type=0,
+        Subtype=0,
+        Switchtype=0,
+        Options={},
+        Used=0,
+        Image=0,
+        **kwargs
+    ):
+        self.Name = Name
+        self.Unit = Unit
+        self.ID = Unit
+        self.DeviceID = str(Unit)
+        self.Type = Type
+        self.SubType = Subtype
+        self.SwitchType = Switchtype
+        self.Options = Options
+        self.Used = Used
+        self.Image = Image
+        self.nValue = 0
+        self.sValue = ""
+        self.TimedOut = 0
+        self.LastLevel = 0
+        self.Writes = 0
+
+    def Create(self):
+        _current.Devices[self.Unit] = self
+
+    def Update(self, nValue, sValue, Image=None, Options=None, TimedOut=0, **kwargs):
+        self.nValue = nValue
+        self.sValue = sValue
+        self.TimedOut = TimedOut
+        if Image is not None:
+            self.Image = Image
+        if Options is not None:
+            self.Options = Options
+        self.Writes += 1
+        _current.Writes += 1
+
+    def Delete(self):
+        del _current.Devices[self.Unit]
+
+    def __str__(self):
+        return "Unit: {}, Name: '{}', nValue: {}, sValue: '{}'".format(
+            self.Unit, self.Name, self.nValue, self.sValue
+        )
+
+
+class Clock:
+    """
+    Virtual UTC clock for the plugin, set with SetClock of the plugin.
+    """
+
+    def __init__(self, utc_now=None):
+        self.utc_now = utc_now or datetime.datetime.utcnow()
+
+    def advance(self, seconds):
+        self.utc_now += datetime.timedelta(seconds=seconds)
+
+    def utcnow(self):
+        return self.utc_now
+
+
+class Plugin:
+    """
+    A loaded plugin.py with its own Domoticz state. The plugin callbacks
+    are available as methods (onStart, onHeartbeat, ...).
+    """
+
+    def __init__(self, location, parameters=None, clock=None, home=None):
+        self.Devices = {}
+        self.Images = {}
+        self.Parameters = {
+            "Key": "xfr_sunmoon",
+            "Name": "SunMoon",
+            "HardwareID": 1,
+            "HomeFolder": home or os.path.dirname(PLUGIN) + os.sep,
+            "Mode1": "",
+            "Mode2": "",
+            "Mode3": "",
+            "Mode4": "",
+            "Mode5": "",
+            "Mode6": "Normal",
+            "Address": "",
+            "Port": "",
+            "Username": "",
+        }
+        self.Parameters.update(parameters or {})
+        self.Settings = {"Location": location}
+        self.Writes = 0
+        self.Messages = {"Log": 0, "Status": 0, "Error": 0, "Debug": 0}
+        self.clock = clock
+        install()
+        spec = importlib.util.spec_from_file_location(
+            "plugin_{}".format(id(self)), PLUGIN
+        )
+        self.module = importlib.util.module_from_spec(spec)
+        self.module.Devices = self.Devices
+        self.module.Images = self.Images
+        self.module.Parameters = self.Parameters
+        self.module.Settings = self.Settings
+        with self:
+            spec.loader.exec_module(self.module)
+        if clock is not None:
+            self.module.SetClock(clock.utcnow)
+
+    def __enter__(self):
+        global _current
+        self.__previous = _current
+        _current = self
+        return self
+
+    def __exit__(self, *args):
+        global _current
+        _current = self.__previous
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        callback = getattr(self.module, name)
+
+        def call(*args):
+            with self:
+                return callback(*args)
+
+        return call
+
+
+class _NoPlugin:
+    Devices = {}
+    Images = {}
+    Writes = 0
+    Messages = {"Log": 0, "Status": 0, "Error": 0, "Debug": 0}
+
+
+_current = _NoPlugin()
+# Print messages of these kinds
+verbose = {"Log", "Status", "Error"}
+
+
+def _message(kind):
+    def message(text):
+        _current.Messages[kind] += 1
+        if kind in verbose:
+            print("{}: {}".format(kind, text), file=sys.stderr)
+
+    return message
+
+
+def install():
+    """Install the fake Domoticz module in sys.modules"""
+    if "Domoticz" in sys.modules:
+        return sys.modules["Domoticz"]
+    module = types.ModuleType("Domoticz")
+    module.Device = Device
+    module.Image = Image
+    module.Debug = _message("Debug")
+    module.Log = _message("Log")
+    module.Status = _message("Status")
+    module.Error = _message("Error")
+    module.Debugging = lambda level: None
+    module.Heartbeat = lambda seconds: None
+    module.Notifier = lambda name: None
+    sys.modules["Domoticz"] = module
+    return module
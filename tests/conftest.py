@@ -0,0 +1,9 @@
+"""
+Tests of the SunMoon plugin, run outside Domoticz with standalone:
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
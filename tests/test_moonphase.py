@@ -0,0 +1,70 @@
+"""
+The moon phase classified from the sun-moon elongation against the
+original classification from the order of the dates of the lunar quarters.
+"""
+import datetime
+import os
+
+import ephem
+
+import standalone
+
+
+def original_phase(utc_now, target_date):
+    """
+    Phase index (0-7) as the plugin classified it before the elongation was
+    used: a principal phase on its local day, otherwise from the order of the
+    previous and next quarters.
+    """
+    dates = {}
+    for phase, name in (
+        (0, "new_moon"),
+        (2, "first_quarter_moon"),
+        (4, "full_moon"),
+        (6, "last_quarter_moon"),
+    ):
+        dates[phase] = [
+            ephem.localtime(getattr(ephem, which + name)(utc_now)).date()
+            for which in ("previous_", "next_")
+        ]
+    for phase in (0, 2, 4, 6):
+        if target_date in dates[phase]:
+            return phase
+    (pn, nn), (pf, nf), (pu, nu), (pl, nl) = (dates[p] for p in (0, 2, 4, 6))
+    if pn < nf < nu < nl < nn:
+        return 1
+    if pf < nu < nl < nn < nf:
+        return 3
+    if pu < nl < nn < nf < nu:
+        return 5
+    if pl < nn < nf < nu < nl:
+        return 7
+    return 4
+
+
+def test_same_phase_names_2024_2026(tmp_path):
+    standalone.verbose = {"Error"}
+    plugin = standalone.Plugin(
+        "52.37;4.89",
+        clock=standalone.Clock(datetime.datetime(2024, 1, 1)),
+        home=str(tmp_path) + os.sep,
+    )
+    plugin.onStart()
+    base = plugin.module._plugin
+    names = base._BasePlugin__MOON_PHASE_DESCRIPTIONS
+    utc_now = datetime.datetime(2024, 1, 1)
+    differences = []
+    samples = 0
+    # The step is not a divisor of a day, so all times of day are sampled
+    while utc_now < datetime.datetime(2027, 1, 1):
+        target_date = ephem.localtime(ephem.Date(utc_now)).date()
+        lunation = base._BasePlugin__lunation(utc_now)
+        new = base._BasePlugin__moonPhase(utc_now, target_date, lunation)
+        original = original_phase(utc_now, target_date)
+        if names[new] != names[original]:
+            differences.append((utc_now, names[original], names[new]))
+        samples += 1
+        utc_now += datetime.timedelta(hours=7, minutes=13)
+    plugin.onStop()
+    assert samples > 3500
+    assert differences == []
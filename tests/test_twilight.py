@@ -0,0 +1,83 @@
+"""
+The sunrise, sunset and twilight times of the twilight solver against the
+searches of ephem, at a spread of latitudes including polar ones.
+"""
+import datetime
+
+import ephem
+import pytest
+
+import standalone
+
+LATITUDES = [-89, -78, -66.5, -45, -20, 0, 20, 45, 52.37, 64, 66.5, 69.65, 75, 82, 89]
+LONGITUDES = [-150, 4.89, 120]
+# Every 9 days over two years, so all seasons at different times of day
+DATES = [datetime.date(2025, 1, 1) + datetime.timedelta(days=9 * k) for k in range(81)]
+# Largest difference with ephem
+PRECISION = ephem.second
+
+
+@pytest.fixture(scope="module")
+def module():
+    standalone.verbose = {"Error"}
+    return standalone.Plugin("52.37;4.89").module
+
+
+def expected(crossing, observer, date, horizons):
+    """
+    Rising, setting and state per horizon from the searches of ephem. A
+    twilight horizon the Sun stays above is a night without twilight when
+    the Sun sets below the first horizon, otherwise the Sun never sets.
+    """
+    record = []
+    for horizon, use_center in horizons:
+        observer.date = ephem.Date(date)
+        observer.horizon = horizon
+        events = []
+        day = crossing.NORMAL
+        for search in (observer.next_rising, observer.next_setting):
+            try:
+                events.append(search(ephem.Sun(), use_center=use_center))
+            except (ephem.AlwaysUpError, ephem.NeverUpError) as e:
+                events.append(None)
+                if day == crossing.NORMAL:
+                    if isinstance(e, ephem.AlwaysUpError):
+                        day = crossing.NEVER_SETS
+                    else:
+                        day = crossing.NEVER_RISES
+        record.append((events[0], events[1], day))
+    for i in range(1, len(record)):
+        rising, setting, day = record[i]
+        if day == crossing.NEVER_SETS and record[0][2] != crossing.NEVER_SETS:
+            record[i] = (rising, setting, crossing.NO_TWILIGHT)
+    return record
+
+
+@pytest.mark.parametrize("lat", LATITUDES)
+def test_crossings_match_ephem(module, lat):
+    horizons = module.BasePlugin._BasePlugin__TWILIGHTS
+    states = set()
+    for lon in LONGITUDES:
+        observer = ephem.Observer()
+        observer.lat = str(lat)
+        observer.lon = str(lon)
+        solver = module.twilight(observer, horizons)
+        for date in DATES:
+            solved = solver.day(date)
+            reference = expected(module.crossing, observer, date, horizons)
+            for (horizon, _), events, (rising, setting, day) in zip(
+                horizons, solved, reference
+            ):
+                where = "{} {} {} horizon {}".format(lat, lon, date, horizon)
+                assert events[2] == day, where
+                for event, reference_event in zip(events[:2], (rising, setting)):
+                    if reference_event is None:
+                        assert event is None, where
+                    else:
+                        assert abs(event - reference_event) < PRECISION, where
+                states.add(day)
+    # Nights without twilight and polar days and nights are covered
+    if 50 < abs(lat) < 70:
+        assert module.crossing.NO_TWILIGHT in states
+    if abs(lat) > 68:
+        assert {module.crossing.NEVER_RISES, module.crossing.NEVER_SETS} <= states